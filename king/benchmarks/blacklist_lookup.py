@@ -0,0 +1,96 @@
+"""Compares blacklist checks against one document per guild and one document per blacklisted user.
+
+For each ban list size, a guild is stored in both schemas and random users, half of them
+blacklisted, are checked: by reading the guild document and looking the user up in its map,
+and by the query of `BlacklistDatabase.contains`, covered by the `(guild_id, user_id)` index.
+Against a real server the plan of the covered query is shown too, it should examine no documents.
+mongomock has no indexes and scans every document, so only a real server shows the flat cost.
+
+Run from the `king` directory, against a local mongod or the optional mongomock-motor package:
+
+    python -m benchmarks.blacklist_lookup --mongo-uri mongodb://localhost:27017
+    python -m benchmarks.blacklist_lookup --mongo-uri mongomock --sizes 10 100 1000
+"""
+import argparse
+import asyncio
+import random
+import time
+from pymongo import InsertOne
+from core.settings_db import BlacklistDatabase
+
+
+def percentiles(samples: list) -> str:
+    samples.sort()
+
+    def pick(q: float) -> float:
+        return samples[min(len(samples) - 1, int(q * len(samples)))] * 1000
+    return f"p50 {pick(0.5):8.3f} ms  p99 {pick(0.99):8.3f} ms"
+
+
+async def measure(database, size: int, lookups: int, rng: random.Random, explain: bool) -> None:
+    guild_id = rng.getrandbits(60)
+    banned = [rng.getrandbits(60) for _ in range(size)]
+
+    per_guild = database["blacklist_per_guild"]
+    per_user = database["blacklist_per_user"]
+    await per_guild.insert_one({"_id": guild_id, "blacklist": {
+        str(user_id): {"reason": "benchmark"} for user_id in banned}})
+    await BlacklistDatabase.create_index(per_user)
+    for i in range(0, size, 1000):
+        await per_user.bulk_write([InsertOne({"guild_id": guild_id, "user_id": user_id, "reason": "benchmark"})
+                                   for user_id in banned[i:i + 1000]])
+
+    users = [rng.choice(banned) if rng.random() < 0.5 else rng.getrandbits(60)
+             for _ in range(lookups)]
+    guild_samples, user_samples = [], []
+    for user_id in users:
+        started = time.perf_counter()
+        doc = await per_guild.find_one({"_id": guild_id})
+        found = str(user_id) in doc["blacklist"]
+        guild_samples.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        covered = await per_user.find_one({"guild_id": guild_id, "user_id": user_id},
+                                          {"_id": 0, "guild_id": 1, "user_id": 1})
+        user_samples.append(time.perf_counter() - started)
+        assert found == (covered is not None)
+
+    print(f"{size:>7} bans  per guild: {percentiles(guild_samples)}  per user: {percentiles(user_samples)}")
+    if explain:
+        plan = await per_user.find({"guild_id": guild_id, "user_id": users[0]},
+                                   {"_id": 0, "guild_id": 1, "user_id": 1}).explain()
+        print(
+            f"{'':>13}covered query examined {plan['executionStats']['totalDocsExamined']} documents")
+
+
+async def run(args) -> None:
+    if args.mongo_uri == "mongomock":
+        from mongomock_motor import AsyncMongoMockClient
+        client = AsyncMongoMockClient()
+    else:
+        from motor.motor_asyncio import AsyncIOMotorClient
+        client = AsyncIOMotorClient(args.mongo_uri)
+
+    name = f"king_benchmark_{random.getrandbits(32):x}"
+    rng = random.Random(args.seed)
+    try:
+        for size in args.sizes:
+            # mongomock has no query planner
+            await measure(client[name], size, args.lookups, rng, args.mongo_uri != "mongomock")
+    finally:
+        await client.drop_database(name)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--mongo-uri", default="mongodb://localhost:27017")
+    parser.add_argument("--sizes", type=int, nargs="+",
+                        default=[10, 100, 1000, 10000, 100000])
+    parser.add_argument("--lookups", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    asyncio.get_event_loop().run_until_complete(run(args))
+
+
+if __name__ == "__main__":
+    main()
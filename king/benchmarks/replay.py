@@ -0,0 +1,225 @@
+"""Replays synthetic guild traffic through the on_message hot path, without a gateway connection.
+
+Fake messages are fed to the `on_message` event registered by `init_events`. They cover commands,
+plain chatter, mentions, DMs and blacklisted authors, in a configurable mix. The harness reports the
+overall throughput and the p50/p95/p99 latency of each stage of the pipeline.
+
+Run from the `king` directory, with local storage:
+
+    python -m benchmarks.replay --messages 50000 --guilds 2000
+
+or against a database, either a local mongod or the optional mongomock-motor package:
+
+    python -m benchmarks.replay --mongo-uri mongodb://localhost:27017
+    python -m benchmarks.replay --mongo-uri mongomock
+"""
+import argparse
+import os
+from pathlib import Path
+import random
+import tempfile
+import time
+import discord
+from discord import Intents
+import yaml
+from core.bot import KingBot
+from core.events import init_events
+from core.metrics import metrics
+
+
+class FakeUser:
+    def __init__(self, id: int, bot: bool = False) -> None:
+        self.id = id
+        self.bot = bot
+        self.mention = f"<@{id}>"
+
+    def mentioned_in(self, message) -> bool:
+        return message.mention_everyone or any(user.id == self.id for user in message.mentions)
+
+    async def send(self, *args, **kwargs) -> None:
+        return
+
+
+class FakeGuild:
+    def __init__(self, id: int) -> None:
+        self.id = id
+
+
+class FakeTextChannel:
+    async def send(self, *args, **kwargs) -> None:
+        return
+
+
+class FakeDMChannel(discord.DMChannel):
+    def __init__(self) -> None:
+        pass
+
+    async def send(self, *args, **kwargs) -> None:
+        return
+
+
+class FakeMessage:
+    def __init__(self, state, author: FakeUser, guild, channel, content: str, mentions: list) -> None:
+        self._state = state
+        self.id = random.getrandbits(63)
+        self.author = author
+        self.guild = guild
+        self.channel = channel
+        self.content = content
+        self.mentions = mentions
+        self.mention_everyone = False
+
+    async def add_reaction(self, emoji) -> None:
+        return
+
+
+class Stages:
+    """Collects the latency samples of each stage."""
+
+    def __init__(self) -> None:
+        self.samples: dict = {}
+
+    def wrap(self, name: str, func):
+        samples = self.samples.setdefault(name, [])
+
+        async def timed(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                samples.append(time.perf_counter() - started)
+        return timed
+
+    def report(self) -> None:
+        print(f"{'STAGE':<16}{'CALLS':>9}{'P50':>11}{'P95':>11}{'P99':>11}")
+        for name, samples in self.samples.items():
+            if not samples:
+                continue
+            samples.sort()
+
+            def pick(q: float) -> str:
+                return f"{samples[min(len(samples) - 1, int(q * len(samples)))] * 1e6:.1f}us"
+            print(
+                f"{name:<16}{len(samples):>9}{pick(0.5):>11}{pick(0.95):>11}{pick(0.99):>11}")
+
+
+def make_bot(args) -> KingBot:
+    config = {"bot_token": "replay", "prefix": "!",
+              "cache_size": args.cache_size}
+    if not args.rate_limit:
+        config.update(rate_limit_user_rate=0, rate_limit_guild_rate=0)
+    if args.mongo_uri == "mongomock":
+        from mongomock_motor import AsyncMongoMockClient
+        import motor.motor_asyncio
+        motor.motor_asyncio.AsyncIOMotorClient = AsyncMongoMockClient
+        config["mongo_db_uri"] = "mongodb://replay"
+    elif args.mongo_uri:
+        config["mongo_db_uri"] = args.mongo_uri
+
+    path = Path("config.yaml")
+    with open(path, "w") as stream:
+        yaml.safe_dump(config, stream)
+
+    bot = KingBot(command_prefix=KingBot.get_prefix,
+                  intents=Intents.all(), config=path)
+
+    @bot.command()
+    async def ping(ctx):
+        return
+
+    return bot
+
+
+async def populate(bot: KingBot, args, rng: random.Random) -> tuple:
+    guilds = [FakeGuild(rng.getrandbits(60)) for _ in range(args.guilds)]
+    users = [FakeUser(rng.getrandbits(60)) for _ in range(args.users)]
+
+    await bot.config.register_guilds([guild.id for guild in guilds])
+    for guild in guilds:
+        banned = {user.id for user in users if rng.random()
+                  < args.blacklist_density}
+        if banned:
+            await bot.config.blacklist.insert_one(
+                guild.id, {"blacklist": {str(user_id): {"reason": "replay"} for user_id in banned}})
+    await bot.config.flush()
+    return guilds, users
+
+
+def make_message(bot: KingBot, args, rng: random.Random, guilds: list, users: list, dm_channel, text_channel) -> FakeMessage:
+    author = rng.choice(users)
+    if rng.random() < args.dm_ratio:
+        return FakeMessage(bot._connection, author, None, dm_channel, "!ping", [])
+
+    guild = rng.choice(guilds)
+    roll = rng.random()
+    if roll < args.command_ratio:
+        return FakeMessage(bot._connection, author, guild, text_channel, "!ping", [])
+    if roll < args.command_ratio + args.mention_ratio:
+        return FakeMessage(bot._connection, author, guild, text_channel, f"{bot.user.mention} hey", [bot.user])
+    return FakeMessage(bot._connection, author, guild, text_channel, "just chatting about things", [])
+
+
+async def replay(bot: KingBot, args) -> None:
+    rng = random.Random(args.seed)
+    bot._connection.user = FakeUser(rng.getrandbits(60), bot=True)
+    init_events(bot)
+    await bot.config.start()
+
+    started = time.perf_counter()
+    guilds, users = await populate(bot, args, rng)
+    print(
+        f"populated {len(guilds)} guilds in {time.perf_counter() - started:.2f}s")
+
+    stages = Stages()
+    bot.guild_settings.get = stages.wrap(
+        "guild_settings", bot.guild_settings.get)
+    bot.get_prefix = stages.wrap("get_prefix", bot.get_prefix)
+    bot.process_commands = stages.wrap(
+        "process_commands", bot.process_commands)
+    on_message = stages.wrap("on_message", bot.on_message)
+
+    dm_channel, text_channel = FakeDMChannel(), FakeTextChannel()
+    messages = [make_message(bot, args, rng, guilds, users, dm_channel, text_channel)
+                for _ in range(args.messages)]
+
+    started = time.perf_counter()
+    for message in messages:
+        await on_message(message)
+    elapsed = time.perf_counter() - started
+
+    print(
+        f"replayed {len(messages)} messages in {elapsed:.2f}s, {len(messages) / elapsed:,.0f} messages/s")
+    stages.report()
+    print(f"{'PIPELINE':<16}{'PASSED':>9}{'DROPPED':>9}{'P50':>11}{'P99':>11}")
+    for stage, passed, dropped, p50, p99 in metrics.stage_summary():
+        print(
+            f"{stage:<16}{passed:>9}{dropped:>9}{p50 * 1e6:>9.1f}us{p99 * 1e6:>9.1f}us")
+    await bot.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, default=20000)
+    parser.add_argument("--guilds", type=int, default=1000)
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--cache-size", type=int, default=100)
+    parser.add_argument("--command-ratio", type=float, default=0.05)
+    parser.add_argument("--mention-ratio", type=float, default=0.01)
+    parser.add_argument("--blacklist-density", type=float, default=0.001,
+                        help="chance of a user being blacklisted in a guild")
+    parser.add_argument("--dm-ratio", type=float, default=0.01)
+    parser.add_argument("--rate-limit", action="store_true",
+                        help="keep the default rate limits, which drop most of the replayed traffic")
+    parser.add_argument("--mongo-uri")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    # the storage lives in core/data relative to the working directory, keep it away from the real one
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        bot = make_bot(args)
+        bot.loop.run_until_complete(replay(bot, args))
+
+
+if __name__ == "__main__":
+    main()
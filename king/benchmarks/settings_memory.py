@@ -0,0 +1,70 @@
+"""Measures how many bytes each cached guild costs, as plain entries and as compact records.
+
+Plain entries are what the caches used to hold, string keys and the nested dicts loaded from the
+local storage. Records are what they hold now, integer keys, shared :PrefixRecord:s and sorted
+:BlacklistRecord: arrays. Both are built in the cache of the configured policy and measured with tracemalloc.
+
+Run from the `king` directory:
+
+    python -m benchmarks.settings_memory --guilds 100000
+"""
+import argparse
+import gc
+import random
+import tracemalloc
+from core.cache_policies import make_cache
+from core.records import BlacklistRecord, PrefixRecord
+
+
+def make_entries(guilds: int, blacklisted: int, custom_prefix_ratio: float) -> tuple:
+    """Builds prefix and blacklist entries as found in the local storage."""
+    rng = random.Random(0)
+    prefixes, blacklist = {}, {}
+    for _ in range(guilds):
+        guild_id = str(rng.getrandbits(60))
+        custom = rng.random() < custom_prefix_ratio
+        prefixes[guild_id] = {"prefixes": [rng.choice(["?", "k!", "$", ">"]) if custom else "!"]}
+        blacklist[guild_id] = {"blacklist": {
+            str(rng.getrandbits(60)): {"reason": "spam"} for _ in range(rng.randint(0, blacklisted))}}
+    return prefixes, blacklist
+
+
+def measure(build, policy: str, size: int) -> int:
+    """Returns the bytes allocated by filling a cache with what `build` yields."""
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    cache = make_cache(policy, size)
+    for key, value in build():
+        cache[key] = value
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return used
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--guilds", type=int, default=50000)
+    parser.add_argument("--blacklisted", type=int, default=4,
+                        help="maximum blacklisted users per guild")
+    parser.add_argument("--custom-prefix-ratio", type=float, default=0.1)
+    parser.add_argument("--policy", default="lru")
+    args = parser.parse_args()
+
+    # the entries stand for the storage on disk, they are copied the way loading them would
+    prefixes, blacklist = make_entries(
+        args.guilds, args.blacklisted, args.custom_prefix_ratio)
+    builds = {
+        "prefix entries": lambda: ((key, {"prefixes": list(value["prefixes"])}) for key, value in prefixes.items()),
+        "prefix records": lambda: ((int(key), PrefixRecord.from_entry(value)) for key, value in prefixes.items()),
+        "blacklist entries": lambda: ((key, {"blacklist": {user_id: dict(fields) for user_id, fields in value["blacklist"].items()}})
+                                      for key, value in blacklist.items()),
+        "blacklist records": lambda: ((int(key), BlacklistRecord.from_entry(value)) for key, value in blacklist.items()),
+    }
+    for name, build in builds.items():
+        used = measure(build, args.policy, args.guilds)
+        print(f"{name:<18} {used / 1024:>10.0f} KiB  {used / args.guilds:>7.1f} bytes per guild")
+
+
+if __name__ == "__main__":
+    main()
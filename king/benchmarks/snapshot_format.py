@@ -0,0 +1,109 @@
+"""Compares the YAML and binary snapshot formats of the local storage.
+
+For each format it measures the time to load every entry, the time to read a single entry,
+the file size, and how much the RSS of a fresh process grows when loading the snapshot.
+
+Run from the `king` directory:
+
+    python -m benchmarks.snapshot_format --guilds 50000
+"""
+import argparse
+import json
+from pathlib import Path
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from core.snapshot import formats
+
+
+def make_storage(guilds: int, blacklisted: int) -> dict:
+    """Builds blacklist-like entries for the given number of guilds."""
+    rng = random.Random(0)
+    return {
+        str(rng.getrandbits(60)): {
+            "blacklist": {
+                str(rng.getrandbits(60)): {"reason": "spam"}
+                for _ in range(rng.randint(0, blacklisted))
+            }
+        }
+        for _ in range(guilds)
+    }
+
+
+def rss_kib() -> int:
+    """Returns the resident set size of this process, in KiB."""
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except FileNotFoundError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def child(name: str, path: str) -> None:
+    """Loads the snapshot in a fresh process and prints how much its RSS grew."""
+    before = rss_kib()
+    storage = formats[name]().load(Path(path))
+    after = rss_kib()
+    print(json.dumps({"entries": len(storage), "rss_kib": after - before}))
+
+
+def measure(name: str, path: Path, storage: dict, lookups: int) -> dict:
+    snapshot = formats[name]()
+    snapshot.dump(path, storage)
+
+    started = time.perf_counter()
+    snapshot.load(path)
+    load = time.perf_counter() - started
+
+    keys = random.Random(1).sample(list(storage), min(lookups, len(storage)))
+    started = time.perf_counter()
+    for key in keys:
+        snapshot.get(path, key)
+    get = (time.perf_counter() - started) / len(keys)
+
+    out = subprocess.run(
+        [sys.executable, "-m", "benchmarks.snapshot_format",
+            "--child", name, str(path)],
+        capture_output=True, text=True, check=True,
+    )
+    return {
+        "format": name,
+        "size_kib": path.stat().st_size // 1024,
+        "load_ms": load * 1000,
+        "get_ms": get * 1000,
+        **json.loads(out.stdout),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--guilds", type=int, default=20000)
+    parser.add_argument("--blacklisted", type=int, default=5,
+                        help="maximum blacklisted users per guild")
+    parser.add_argument("--lookups", type=int, default=5)
+    parser.add_argument("--child", nargs=2, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        return child(*args.child)
+
+    storage = make_storage(args.guilds, args.blacklisted)
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, snapshot in formats.items():
+            result = measure(name, Path(tmp) / f"blacklist{snapshot.suffix}",
+                             storage, args.lookups)
+            print(
+                f"{result['format']:>7}: {result['entries']} entries, {result['size_kib']} KiB, "
+                f"load {result['load_ms']:.1f} ms, single entry {result['get_ms']:.3f} ms, "
+                f"load RSS +{result['rss_kib']} KiB"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,102 +1,303 @@
-from abc import ABC, abstractmethod
+from abc import ABC
+from collections.abc import MutableMapping
 import asyncio
+from datetime import timedelta
+from functools import cached_property
 import json
 from pathlib import Path
+import sys
 import time
-from cachetools import LFUCache
-from motor.motor_asyncio import AsyncIOMotorCollection
+from typing import TYPE_CHECKING, Any, Callable, Iterable, Optional
+import uuid
+from cachetools import TTLCache
 import yaml
+from .cache_policies import make_cache
 from .errors import CacheNotFoundError, DatabaseNotFoundError
+from .metrics import metrics
+from .persistence import SnapshotWriter, SyncWatermark
+from .profiler import profiler
+from .sharding import ShardPartition
+from .singleflight import SingleFlight
+from .snapshot import YamlSnapshot, formats
+from .write_behind import WriteBehindQueue
 from .utils.color import printer
 
+if TYPE_CHECKING:
+    from motor.motor_asyncio import AsyncIOMotorCollection
+
 
 class Manager:
     """Common class that represents a manager of YAML and cached data.
+
+    The cache is keyed by integer guild ID. Its values are the stored entries converted by `record_type`,
+    e.g. :PrefixRecord:, or the entries themselves when it is None.
     """
 
     dir_ = Path("core/data")
+    # converts a stored entry into its cached form with its `from_entry` classmethod
+    record_type = None
 
     def __init__(self, path_, config: dict):
         Path.mkdir(Manager.dir_, parents=True, exist_ok=True)
-        Path.touch(path_, exist_ok=True)
 
-        with open(path_) as p:
-            started = time.time()
-            self.name = self.__class__.__name__[:-7].upper()
-            self._config = config
-            self._max_size = self._config["CACHE_SIZE"]
-            self._cached: LFUCache = LFUCache(self._max_size)
-            local_storage: dict = yaml.load(
-                p, Loader=yaml.FullLoader)
-            self._cached.update(local_storage) if local_storage else {}
-            elapsed = time.time() - started
-            printer(
-                "DATA", f"{self.name} CACHE WAS SET IN {elapsed}SECONDS and MAXSIZE IS {self._cached.maxsize}")
+        started = time.time()
+        self.name = self.__class__.__name__[:-7].upper()
+        self._config = config
+        snapshot_format = formats[self._config.get("STORAGE_FORMAT", "yaml")]()
+        self.snapshot_path: Path = Path(path_).with_suffix(
+            snapshot_format.suffix)
+        self._migrate(Path(path_), snapshot_format)
+        Path.touch(self.snapshot_path, exist_ok=True)
+
+        self._max_size = self._config["CACHE_SIZE"]
+        self._policy: str = self._config.get("CACHE_POLICY", "lfu")
+        self._ttl: float = self._config.get("CACHE_TTL", 3600)
+        self._cached: MutableMapping = make_cache(
+            self._policy, self._max_size, self._ttl)
+        # keys known to be absent, so repeated misses skip the YAML and database
+        self._missing: TTLCache = TTLCache(
+            self._config.get("NEGATIVE_CACHE_SIZE", 1000),
+            self._config.get("NEGATIVE_CACHE_TTL", 300),
+        )
+        # snapshot reads in flight, shared by concurrent misses of the same key
+        self._inflight = SingleFlight("snapshot", self.name.lower())
+        self._writer = SnapshotWriter(
+            self.snapshot_path, snapshot_format, self._config.get("SNAPSHOT_INTERVAL", 1.0))
+        # called with (key, value) whenever an entry changes, value is None if it was only invalidated
+        self._listeners: list = []
+        # unique per manager so it can ignore its own messages on the cache bus
+        self.origin = uuid.uuid4().hex
+        if self._config.get("BUS"):
+            self._config["BUS"].subscribe(self.name, self._on_bus_message)
+        profiler.begin(f"snapshot.{self.name.lower()}")
+        local_storage: dict = self._writer.load()
+        self.loaded: int = len(local_storage)
+        # only the guilds of the shards run by this process are kept in memory
+        self._partition: ShardPartition = self._config.get(
+            "PARTITION") or ShardPartition()
+        for key, value in local_storage.items():
+            self.admit(key, value)
+        profiler.end(f"snapshot.{self.name.lower()}")
+        elapsed = time.time() - started
+        printer(
+            "DATA", f"{self.name} CACHE WAS SET IN {elapsed}SECONDS and MAXSIZE IS {self._cached.maxsize}")
+
+    def _migrate(self, yaml_path: Path, snapshot_format) -> None:
+        """Converts an existing YAML storage into the configured snapshot format, once.
+        The YAML file is kept with a `.migrated` suffix.
+
+        Args:
+            yaml_path (Path): The path of the YAML storage.
+            snapshot_format (Union[YamlSnapshot, BinarySnapshot]): The configured snapshot format.
+        """
+        if self.snapshot_path == yaml_path or self.snapshot_path.exists() or not yaml_path.exists():
+            return
+
+        storage = YamlSnapshot().load(yaml_path)
+        snapshot_format.dump(self.snapshot_path, storage)
+        yaml_path.rename(yaml_path.with_suffix(".yaml.migrated"))
+        printer(
+            "DATA", f"MIGRATED {len(storage)} {self.name} ENTRIES FROM {yaml_path} TO {self.snapshot_path}")
+
+    async def stored_entry(self, key) -> Optional[dict]:
+        """Returns the full stored entry of a key, with the fields its cached record leaves out.
+
+        Args:
+            key (Union[int, str]): The guild id to look up.
+
+        Returns:
+            Optional[dict]: The stored entry or None if the key does not exist.
+        """
+        return await self._fetch_yaml(str(key))
+
+    async def _fetch_yaml(self, key: str) -> dict:
+        """Returns the stored value of a key, including writes that have not been flushed yet.
+        The file itself is read in a worker thread, a binary snapshot only reads the one entry.
+
+        Args:
+            key (str): The key to look up.
+
+        Returns:
+            dict: The stored value or None if the key does not exist.
+        """
+        return await self._writer.get(key)
 
-    def _fetch_yaml(self) -> dict:
-        """Returns a dictionary version of the YAML configuration.
+    def snapshot(self) -> dict:
+        """Reads every stored entry. Blocking, only meant to be used before the bot starts.
 
         Returns:
-            dict: Dict representation of the YAML file.
+            dict: Every entry of the YAML file, keyed by guild id.
+        """
+        return self._writer.load()
+
+    async def flush(self) -> None:
+        """Writes every pending change of the local storage to disk.
         """
-        with open(self.path_) as p:
-            return yaml.load(
-                p, Loader=yaml.FullLoader)
+        await self._writer.flush()
 
-    def _append_yaml(self, extra_config: dict) -> None:
-        """Appends to the existing YAML config.
-        Creates an empty YAML config if there is none found.
+    def _on_bus_message(self, message: dict) -> None:
+        """Applies a change published by another process on the cache bus.
 
         Args:
-            extra_config (dict): The additional data to be passed down to the config.
+            message (dict): The published message, see :CacheBus:.
         """
+        if message["origin"] == self.origin:
+            return
 
-        with open(self.path_) as p:
-            prefixes: dict = yaml.load(p, Loader=yaml.FullLoader)
-            prefixes = prefixes if prefixes else {}
+        key, value = message["key"], message["value"]
+        if value is None:
+            self.invalidate(key)
+            self._cached.pop(int(key), None)
+            self._notify(key, None)
+            return
 
-        with open(self.path_, "w") as pp:
-            prefixes.update(extra_config)
-            yaml.safe_dump(prefixes, pp)
+        self._store(key, value)
 
-    def _set_yaml(self, new_config: dict) -> None:
-        """Completely replaces the existing configuration found within the YAML file."
+    def add_listener(self, callback: Callable[[str, Optional[dict]], None]) -> None:
+        """Registers a callback for every change of an entry, whether local or from the cache bus.
 
         Args:
-            new_config (dict): The new configuration to set the YAML file to.
+            callback (Callable[[str, Optional[dict]], None]): The function called with the key and the new value, or None if the key was only invalidated.
         """
-        with open(self.path_, 'w') as p:
-            printer(
-                "INFO", f"SYNCING YAML WITH {self.name} CACHE \n{new_config}\n")
+        self._listeners.append(callback)
+
+    def _notify(self, key: str, value: Optional[dict]) -> None:
+        for callback in self._listeners:
+            callback(key, value)
 
-            yaml.safe_dump(new_config, p)
+    def _store(self, key: str, value: dict) -> None:
+        """Writes the value to the cache and YAML file and notifies the listeners.
+
+        Args:
+            key (str): The guild id of the entry.
+            value (dict): The new value of the entry.
+        """
+        self.invalidate(key)
+        self.admit(key, value)
+        self._writer.mark_dirty(key, value)
+        self._notify(key, value)
+
+    def to_record(self, value: dict):
+        """Converts a stored entry into the value kept by the cache, see :Manager:record_type:.
+
+        Args:
+            value (dict): The stored entry.
+
+        Returns:
+            Any: The cached record.
+        """
+        return self.record_type.from_entry(value) if self.record_type else value
+
+    def admit(self, key: str, value: dict):
+        """Stores the record of the value in the cache if its guild belongs to one of the shards run by this process.
+
+        Args:
+            key (str): The guild id of the entry.
+            value (dict): The stored entry.
+
+        Returns:
+            Any: The record of the value, see :Manager:to_record:.
+        """
+        record = self.to_record(value)
+        if self._partition.owns(key):
+            self._cached[int(key)] = record
+        return record
+
+    def resize(self, maxsize: int) -> None:
+        """Changes the size of the cache without dropping its entries, see :CacheStats:resize:.
+
+        Args:
+            maxsize (int): The new maximum number of cached entries.
+        """
+        self._max_size = maxsize
+        self._cached.resize(maxsize)
+        printer(
+            "DATA", f"{self.name} CACHE RESIZED TO {maxsize}, KEPT {len(self._cached)} ENTRIES")
+
+    def repartition(self) -> int:
+        """Drops the cached entries of guilds that no longer belong to the shards run by this process.
+        Guilds of newly added shards are loaded on their first lookup.
+
+        Returns:
+            int: The number of dropped entries.
+        """
+        dropped = [key for key in self._cached if not self._partition.owns(key)]
+        for key in dropped:
+            self._cached.pop(key, None)
+        for key in [key for key in self._missing if not self._partition.owns(key)]:
+            self._missing.pop(key, None)
+        return len(dropped)
 
     @staticmethod
-    def dict_to_cache(dict_: dict, size: int) -> LFUCache:
-        l = LFUCache(maxsize=size)
-        l.update(dict_)
-        return l
+    def key_of(entry: dict) -> str:
+        """Returns the cache key for a lookup entry such as `{"_id": guild_id}`.
 
-    @property
-    def cache(self) -> dict:
-        return self._cached
+        Args:
+            entry (dict): The dictionary of the value to look up.
+
+        Returns:
+            str: The key used by the cache and the YAML file.
+        """
+        return str(list(entry.values())[0])
 
-    @cache.setter
-    def cache(self, new_cache: dict) -> None:
-        """Replaces the existing cache with the provided one.
+    def is_missing(self, key: str) -> bool:
+        """Checks whether the key was recently looked up and not found.
 
         Args:
-            new_cache (dict): The new configuration to set the cache on.
+            key (str): The cache key to check.
+
+        Returns:
+            bool: Whether or not the key is negatively cached.
         """
-        new_cache = self.dict_to_cache(new_cache, self._max_size)
-        if new_cache == self._cached:
-            return
+        return key in self._missing
+
+    def mark_missing(self, key: str) -> None:
+        """Remembers that the key does not exist until the negative cache TTL expires.
+
+        Args:
+            key (str): The cache key that was not found.
+        """
+        self._missing[key] = True
+
+    def invalidate(self, key) -> None:
+        """Drops the negative cache entry for the key, to be called whenever the key is written.
+
+        Args:
+            key (Union[int, str]): The guild id or cache key that was written.
+        """
+        self._missing.pop(str(key), None)
+
+    @property
+    def cache_stats(self) -> dict:
+        """Hits, misses and evictions of the cache, see :CacheStats:."""
+        return self._cached.stats
+
+    def memory_usage(self) -> dict:
+        """Estimates the bytes held by the cached keys and records, walking every entry.
+        Records shared by several guilds are counted once, the tables of the cache itself are not counted.
+
+        Returns:
+            dict: The number of entries, the bytes of their keys and records, and the bytes per guild.
+        """
+        seen, key_bytes, record_bytes = set(), 0, 0
+        for key, record in list(self._cached.items()):
+            key_bytes += sys.getsizeof(key)
+            if id(record) not in seen:
+                seen.add(id(record))
+                record_bytes += record.sizeof() if hasattr(record, "sizeof") else sys.getsizeof(record)
+        entries = len(self._cached)
+        return {
+            "entries": entries,
+            "key_bytes": key_bytes,
+            "record_bytes": record_bytes,
+            "bytes_per_guild": (key_bytes + record_bytes) / entries if entries else 0.0,
+        }
 
-        self._cached = new_cache
-        self._set_yaml(dict(self._cached))
-        return
+    @property
+    def cache(self) -> dict:
+        return self._cached
 
-    async def find_one(self, entry: dict) -> dict:
+    async def find_one(self, entry: dict) -> Any:
         """Looks at the cache for the given entry and returns the results. If no entry is found, the actual file will be looked at and the cache will be updated.
 
         Args:
@@ -106,23 +307,65 @@ class Manager:
             KeyError: If the value for the given dictionary is not found within either the cache or the YAML.
 
         Returns:
-            list[str]: A list of results from the queried entry.
+            Any: The cached record of the queried entry, see :Manager:record_type:.
         """
-        key = str(list(entry.values())[0])
+        key = self.key_of(entry)
+        collection = self.name.lower()
 
         # we can do this since there will always be a default assigned
-        ret = self._cached.get(key, None)
-        if ret:
+        started = time.perf_counter()
+        ret = self._cached.get(int(key), None)
+        if ret is not None:
+            metrics.record_lookup("cache", collection, "hit",
+                                  time.perf_counter() - started)
             return ret
 
-        # Tries with refreshed cache in case it fails
-        ret = self._fetch_yaml().get(key, None)
-        if ret:
-            self._cached.update({key: ret})
+        if self.is_missing(key):
+            metrics.record_lookup("negative", collection, "hit",
+                                  time.perf_counter() - started)
+            raise CacheNotFoundError(
+                f"No {self.name} entry found in cache for given key. {key}")
+        metrics.record_lookup("cache", collection, "miss",
+                              time.perf_counter() - started)
+
+        # Tries with refreshed cache in case it fails, once for every concurrent lookup of the key
+        ret = await self._inflight.do(key, lambda: self._load(key))
+        if ret is not None:
             return ret
+
         raise CacheNotFoundError(
             f"No {self.name} entry found in cache for given key. {key}")
 
+    async def _load(self, key: str) -> Optional[dict]:
+        """Reads a key from the snapshot into the cache, remembering it as missing if it is not stored.
+
+        Args:
+            key (str): The key to load.
+
+        Returns:
+            Any: The record of the stored value or None if the key does not exist.
+        """
+        collection = self.name.lower()
+        started = time.perf_counter()
+        ret = await self._fetch_yaml(key)
+        elapsed = time.perf_counter() - started
+        if ret:
+            metrics.record_lookup("snapshot", collection, "hit", elapsed)
+            return self.admit(key, ret)
+
+        metrics.record_lookup("snapshot", collection, "miss", elapsed)
+        self.mark_missing(key)
+        return None
+
+    def merge(self, entries: dict) -> None:
+        """Updates the cache and the YAML file with the given entries, leaving every other entry untouched.
+
+        Args:
+            entries (dict): The entries to update, keyed by guild id.
+        """
+        for key, value in entries.items():
+            self._store(str(key), value)
+
     async def insert_one(self, key: int, value: dict) -> None:
         """Inserts a value into the yaml configuration, updating the cached config as well.
 
@@ -130,24 +373,58 @@ class Manager:
             key (int): The guild id of the guild's config to update.
             value (dict): The dictionary to add to the configuration.
         """
-        key = str(key)
-        self._cached[key] = value
-        self._append_yaml(self._cached)
+        self._store(str(key), value)
+
+    async def insert_many(self, entries: dict) -> None:
+        """Inserts several values into the yaml configuration at once, see :Manager:merge:.
+
+        Args:
+            entries (dict): The values to add, keyed by guild id.
+        """
+        self.merge(entries)
+
+    async def missing(self, keys: Iterable) -> list:
+        """Returns the keys that have no stored entry, reading the stored keys once for all of them.
+
+        Args:
+            keys (Iterable): The guild ids to check.
+
+        Returns:
+            list: The guild ids without an entry.
+        """
+        stored = await self._writer.keys()
+        return [key for key in keys if str(key) not in stored]
 
 
 class Database(ABC):
     """Common class that represents a database.
     """
 
+    # re-pull documents this close to the watermark, in case they were committed out of order
+    sync_overlap = timedelta(seconds=5)
+    # the fields identifying a document, see :Database:_documents:
+    key_fields = ("_id",)
+
     def __init__(self, config: dict, collection_name: str) -> None:
         self._config: dict = config
-        self._collection: AsyncIOMotorCollection = config['CLUSTER'][collection_name]
+        self._collection: "AsyncIOMotorCollection" = config['CLUSTER'][collection_name]
+        self._writes = WriteBehindQueue(
+            self._collection,
+            config.get("WRITE_BATCH_SIZE", 100),
+            config.get("WRITE_FLUSH_INTERVAL", 1.0),
+            self.key_fields,
+        )
         self.loop = asyncio.get_event_loop()
 
     @property
     def cache(self) -> dict:
         return self._cache_manager.cache
 
+    @cached_property
+    def _inflight(self) -> SingleFlight:
+        # database reads in flight, shared by concurrent misses of the same key
+        return SingleFlight("mongo", self._cache_manager.name.lower())
+
     @staticmethod
     def dict_to_yaml(dict_: dict) -> None:
         """Serializes an object, expectedly a dictionary into a YAML stream. While redundant-looking this solution works.
@@ -157,27 +434,195 @@ class Database(ABC):
         """
         return yaml.load(yaml.dump(json.loads(json.dumps(dict_))), Loader=yaml.FullLoader)
 
-    def find(self) -> list:
-        return self.loop.run_until_complete(self._find())
+    @property
+    def cache_stats(self) -> dict:
+        """Hits, misses and evictions of the cache, see :CacheStats:."""
+        return self._cache_manager.cache_stats
+
+    def snapshot(self) -> dict:
+        """Reads every locally stored entry, see :Manager:snapshot:.
+
+        Returns:
+            dict: Every entry of the YAML file, keyed by guild id.
+        """
+        return self._cache_manager.snapshot()
+
+    def memory_usage(self) -> dict:
+        """Estimates the bytes held by the cache, see :Manager:memory_usage:.
+
+        Returns:
+            dict: The number of entries, the bytes of their keys and records, and the bytes per guild.
+        """
+        return self._cache_manager.memory_usage()
+
+    def add_listener(self, callback: Callable[[str, Optional[dict]], None]) -> None:
+        """Registers a callback for every change of an entry, see :Manager:add_listener:.
+
+        Args:
+            callback (Callable[[str, Optional[dict]], None]): The function called with the key and the new value.
+        """
+        self._cache_manager.add_listener(callback)
+
+    def resize(self, maxsize: int) -> None:
+        """Changes the size of the cache without dropping its entries, see :Manager:resize:.
+
+        Args:
+            maxsize (int): The new maximum number of cached entries.
+        """
+        self._cache_manager.resize(maxsize)
+
+    def repartition(self) -> int:
+        """Drops the cached entries of guilds owned by other processes, see :Manager:repartition:.
+
+        Returns:
+            int: The number of dropped entries.
+        """
+        return self._cache_manager.repartition()
+
+    def invalidate(self, key) -> None:
+        """Drops the negative cache entry for the key, see :Manager:invalidate:.
+
+        Args:
+            key (Union[int, str]): The guild id that was written.
+        """
+        self._cache_manager.invalidate(key)
+
+    @property
+    def queue_depth(self) -> int:
+        """The number of writes waiting to be sent to the database."""
+        return self._writes.depth
+
+    async def flush(self) -> None:
+        """Sends every queued write to the database and every pending change of the local storage to disk.
+        """
+        await self._writes.flush()
+        await self._cache_manager.flush()
+
+    def sync(self) -> int:
+        """Blocking version of :Database:_sync:, meant to be used before the bot starts.
+
+        Returns:
+            int: The number of documents pulled from the database.
+        """
+        return self.loop.run_until_complete(self._sync())
+
+    async def _sync(self) -> int:
+        """Pulls the documents changed since the last sync into the cache and YAML file.
+
+        Documents are streamed in cursor batches of `sync_batch_size`. The sync starts from the stored
+        watermark, minus a small overlap for writes committed out of order, unless the local storage is empty.
+
+        Returns:
+            int: The number of documents pulled from the database.
+        """
+        manager = self._cache_manager
+        watermark = SyncWatermark(manager.snapshot_path.with_suffix(".sync"))
+        since = watermark.load() if manager.loaded else None
+        batch_size = self._config.get("SYNC_BATCH_SIZE", 1000)
+
+        await self._ensure_indexes()
+        if since is None:
+            # version documents written before updated_at existed, so the next sync can skip them
+            await self._collection.update_many(
+                {"updated_at": {"$exists": False}}, {"$currentDate": {"updated_at": True}})
+        query = {"updated_at": {"$gt": since - self.sync_overlap}} if since else {}
+        cursor = self._collection.find(query, batch_size=batch_size)
+
+        newest, pulled, changed = since, 0, {}
+        async for doc in cursor:
+            updated_at = doc.pop("updated_at", None)
+            if updated_at and (newest is None or updated_at > newest):
+                newest = updated_at
+            await self._collect(changed, doc)
+            if len(changed) >= batch_size:
+                pulled += len(changed)
+                manager.merge(changed)
+                changed = {}
+        pulled += len(changed)
+        manager.merge(changed)
+
+        await manager.flush()
+        if newest:
+            watermark.save(newest)
+        return pulled
+
+    async def _ensure_indexes(self) -> None:
+        """Creates the indexes the queries of the collection rely on, the delta sync needs `updated_at`."""
+        await self._collection.create_index("updated_at")
+
+    async def _collect(self, changed: dict, doc: dict) -> None:
+        """Adds a document pulled by :Database:_sync: to the changed entries, keyed by guild id.
+
+        Args:
+            changed (dict): The entries to merge into the local storage.
+            doc (dict): The pulled document, without its `updated_at`.
+        """
+        changed[str(doc.pop("_id"))] = doc
+
+    def _documents(self, guild_id: int, entry: dict) -> dict:
+        """Maps an entry to the documents storing it, keyed as the write queue expects, see :Database:key_fields:.
+
+        Args:
+            guild_id (int): The id of the guild.
+            entry (dict): The entry of the guild.
+
+        Returns:
+            dict: The fields to set, keyed by document.
+        """
+        return {guild_id: entry}
 
-    @abstractmethod
-    async def _find(self) -> dict:
-        raise NotImplementedError()
+    async def _publish(self, guild_id: int, entry: dict) -> None:
+        if self._config.get("BUS"):
+            await self._config["BUS"].publish(
+                self._cache_manager.name, self._cache_manager.origin, str(guild_id), entry)
 
     async def insert_one(self, guild_id: int, entry: dict) -> None:
-        """Inserts the given entry into the MongoDB database, as well as the cache and YAML file.
+        """Inserts the given entry into the cache and YAML file, and queues an upsert of it into the MongoDB database.
+        The upsert is sent with the next batch, see :WriteBehindQueue:.
 
         Args:
             guild_id (int): The id of the guild.
             entry (dict): The config to upload, expected to be a prefixes key.
         """
-        to_insert = {"_id": guild_id}
-        to_insert.update(entry)
-
-        await self._collection.insert_one(to_insert)
         await self._cache_manager.insert_one(guild_id, entry)
+        for key, fields in self._documents(guild_id, entry).items():
+            await self._writes.put(key, fields)
+        await self._publish(guild_id, entry)
 
-    async def find_one(self, entry: dict) -> dict:
+    async def insert_many(self, entries: dict) -> None:
+        """Inserts several entries into the cache and YAML file, and upserts them into the MongoDB database
+        right away with a single `bulk_write`.
+
+        Args:
+            entries (dict): The configs to upload, keyed by guild id.
+        """
+        await self._cache_manager.insert_many(entries)
+        await self._writes.put_many({key: fields for guild_id, entry in entries.items()
+                                     for key, fields in self._documents(guild_id, entry).items()})
+        for guild_id, entry in entries.items():
+            await self._publish(guild_id, entry)
+
+    async def missing(self, keys: Iterable) -> list:
+        """Returns the keys that have no document, with one `_id` query per `sync_batch_size` keys.
+        Documents still waiting in the write queue count as existing.
+
+        Args:
+            keys (Iterable): The guild ids to check.
+
+        Returns:
+            list: The guild ids without a document.
+        """
+        keys = [key for key in keys if key not in self._writes]
+        batch_size = self._config.get("SYNC_BATCH_SIZE", 1000)
+        stored = set()
+        for i in range(0, len(keys), batch_size):
+            # answered from the _id index alone
+            cursor = self._collection.find(
+                {"_id": {"$in": keys[i:i + batch_size]}}, {"_id": 1})
+            stored.update([document["_id"] async for document in cursor])
+        return [key for key in keys if key not in stored]
+
+    async def find_one(self, entry: dict) -> Any:
         """Much like :Manager:find_one: but includes searching the database as a last resort.
 
         Args:
@@ -187,23 +632,73 @@ class Database(ABC):
             DatabaseNotFoundError: Error which indicates that the entry does not exist in the database.
 
         Returns:
-            dict: A dictionary representing the result.
+            Any: The cached record of the result, see :Manager:record_type:.
         """
         name = self.collection_name
+        key = self._cache_manager.key_of(entry)
+        collection = self._cache_manager.name.lower()
+
+        # Another lookup is already asking the database, the key may be marked missing by its snapshot miss
+        if key in self._inflight:
+            return await self._find_in_database(entry, key)
+
+        # A recent miss means the database does not have it either
+        if self._cache_manager.is_missing(key):
+            metrics.record_lookup("negative", collection, "hit", 0.0)
+            raise DatabaseNotFoundError(
+                f"No {name} entry found in database for given key. {key}")
 
         # This will try from the cache first and then YAML
         try:
             ret = await self._cache_manager.find_one(entry)
-            if ret:
+            if ret is not None:
                 return ret
         except CacheNotFoundError as e:
             pass
 
-            # Contact database as the last resort
-            ret = await self._collection.find_one(entry)
-            if ret:
-                self._cache_manager.cache.update(entry)
-                return ret
+        # Contact database as the last resort
+        return await self._find_in_database(entry, key)
 
-            raise DatabaseNotFoundError(
-                f"No {name} entry found in database for given key. {list(entry.values())[0]}")
+    async def _find_in_database(self, entry: dict, key: str) -> dict:
+        """Looks the entry up in the database, once for every concurrent lookup of the key.
+
+        Args:
+            entry (dict): The dictionary of the value to look up.
+            key (str): The key of the entry.
+
+        Raises:
+            DatabaseNotFoundError: Error which indicates that the entry does not exist in the database.
+
+        Returns:
+            Any: The cached record of the result, see :Manager:record_type:.
+        """
+        ret = await self._inflight.do(key, lambda: self._fetch(entry, key))
+        if ret is not None:
+            return ret
+
+        raise DatabaseNotFoundError(
+            f"No {self.collection_name} entry found in database for given key. {key}")
+
+    async def _query(self, entry: dict) -> Optional[dict]:
+        """Reads the entry from the collection.
+
+        Args:
+            entry (dict): The dictionary of the value to look up.
+
+        Returns:
+            Optional[dict]: The entry without its `_id` and `updated_at`, or None if there is none.
+        """
+        return await self._collection.find_one(entry, {"_id": 0, "updated_at": 0})
+
+    async def _fetch(self, entry: dict, key: str) -> Optional[dict]:
+        collection = self._cache_manager.name.lower()
+        started = time.perf_counter()
+        ret = await self._query(entry)
+        metrics.record_lookup("mongo", collection, "hit" if ret else "miss",
+                              time.perf_counter() - started)
+        if ret:
+            self._cache_manager.invalidate(key)
+            return self._cache_manager.admit(key, ret)
+
+        self._cache_manager.mark_missing(key)
+        return None
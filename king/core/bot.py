@@ -1,3 +1,4 @@
+import importlib
 import os
 from typing import Union
 import discord
@@ -5,6 +6,12 @@ from discord.ext.commands import *
 from .config import Config
 from .settings_db import BlacklistDatabase, PrefixDatabase
 from .events import init_events
+from .guild_settings import GuildSettingsCache, current_settings
+from .metrics import metrics
+from .outbound import OutboundQueue, Priority
+from .pipeline import MessagePipeline
+from .profiler import profiler
+from .ratelimit import RateLimiter
 from .settings_caches import BlacklistManager, PrefixManager
 from .utils.color import colorify, printer, Color
 from .utils.embed import embed
@@ -21,18 +28,82 @@ class KingBot(AutoShardedBot):
     """Class Representing an instance of King."""
 
     def __init__(self, config: dict, *args, **kwargs) -> None:
-        super().__init__(description=description, *args, **kwargs)
-
         # DEV MODE
         self.dev: bool = kwargs.pop('dev', False)
 
         # DB COLLECTIONS
         self._config: Config = Config(config)
+
+        # SHARDS, automatic unless set in the config
+        if self._config.SHARD_COUNT is not None:
+            kwargs.setdefault('shard_ids', self._config.SHARD_IDS)
+            kwargs.setdefault('shard_count', self._config.SHARD_COUNT)
+
+        super().__init__(description=description, *args, **kwargs)
+        # bumped whenever the loaded extensions change, so caches of their commands know to rebuild
+        self.extensions_generation: int = 0
+        # command name to the deferred extension providing it, see :KingBot:load_extensions:
+        self._lazy_extensions: dict = {}
         self._prefixes: Union[PrefixDatabase,
                               PrefixManager] = self._config.prefixes
         self._blacklist: Union[BlacklistDatabase,
                                BlacklistManager] = self._config.blacklist
 
+        # GUILD SETTINGS, rebuilt whenever one of them changes in the storage
+        self.guild_settings: GuildSettingsCache = GuildSettingsCache(
+            self._resolve_prefixes, self._blacklist.record, self._config.CACHE_SIZE)
+        for storage in (self._prefixes, self._blacklist):
+            storage.add_listener(
+                lambda key, value: self.guild_settings.invalidate(key))
+        self._config.add_reload_listener(self._on_config_reload)
+
+        # MESSAGE PIPELINE, its stages are registered by init_events and cogs
+        self.message_pipeline: MessagePipeline = MessagePipeline(
+            self._config.MESSAGE_STAGE_COSTS)
+
+        # LOAD SHEDDING, checked before anything else is done for a message
+        self.rate_limiter: RateLimiter = RateLimiter(
+            self._config.RATE_LIMIT_USER_RATE,
+            self._config.RATE_LIMIT_USER_BURST,
+            self._config.RATE_LIMIT_GUILD_RATE,
+            self._config.RATE_LIMIT_GUILD_BURST,
+            self._config.RATE_LIMIT_SWEEP_INTERVAL,
+        )
+        metrics.add_collector(lambda: [
+            ("king_ratelimit_buckets", (("scope", scope),), count)
+            for scope, count in self.rate_limiter.stats.items()
+        ])
+
+        # OUTBOUND CALLS, sent within a budget so they do not delay command responses
+        self.outbound: OutboundQueue = OutboundQueue(
+            self._config.OUTBOUND_RATE,
+            self._config.OUTBOUND_BURST,
+            self._config.OUTBOUND_QUEUE_SIZE,
+            self._config.OWNER_DIGEST_INTERVAL,
+        )
+        metrics.add_collector(lambda: [
+            ("king_outbound_queue_depth", (("priority", priority),), count)
+            for priority, count in self.outbound.stats.items()
+        ])
+
+    def _on_config_reload(self, changes: dict) -> None:
+        if "cache_size" in changes:
+            self.guild_settings.resize(self.config.CACHE_SIZE)
+        if "owner_digest_interval" in changes:
+            self.outbound.digest_interval = self.config.OWNER_DIGEST_INTERVAL
+
+    def load_extension(self, name: str, *, package: str = None) -> None:
+        super().load_extension(name, package=package)
+        self.extensions_generation += 1
+
+    def unload_extension(self, name: str, *, package: str = None) -> None:
+        super().unload_extension(name, package=package)
+        self.extensions_generation += 1
+
+    def reload_extension(self, name: str, *, package: str = None) -> None:
+        super().reload_extension(name, package=package)
+        self.extensions_generation += 1
+
     @property
     def config(self) -> Config:
         return self._config
@@ -55,64 +126,165 @@ class KingBot(AutoShardedBot):
     def user_is_admin(self, user: discord.User) -> bool:
         return user.guild_permissions.administrator
 
+    def repartition(self) -> None:
+        """Restricts the settings caches to the guilds of the shards run by this process.
+        """
+        # every shard launched by this process, self.shards only holds those connected so far
+        shard_ids = self.shard_ids
+        if shard_ids is None and self.shard_count is not None:
+            shard_ids = range(self.shard_count)
+        self.config.repartition(shard_ids, self.shard_count)
+
     async def load_extensions(self, dirname: str) -> None:
         """Loads the extensions found in the given directory.
 
+        Extensions listed in the `manifest` of the package are only loaded the first time one of their
+        commands is used, unless marked `preload`.
+
         Args:
             dirname (str): The name/path of the directory to load the cogs from.
         """
         await self.wait_until_ready()
+        profiler.begin("extensions")
 
         cogs_text = ""
         i = 0
-        cogs = [file for file in os.listdir(dirname) if file.endswith(
+        package = dirname[2:].replace("/", ".")
+        manifest = getattr(importlib.import_module(package), "manifest", {})
+        cogs = [file[:-3] for file in os.listdir(dirname) if file.endswith(
             '.py') and not file.startswith('__init__')]
 
+        preload = []
         for cog in cogs:
+            name = f'{package}.{cog}'
+            entry = manifest.get(cog, {"preload": True})
+            if name in self.extensions:
+                continue
+            if entry.get("preload"):
+                preload.append(name)
+                continue
+            for command in entry.get("commands", []):
+                self._lazy_extensions[command] = name
+            cogs_text += f"🟡 Deferred {cog}\n"
+
+        for name in preload:
+            cog = name.rsplit(".", 1)[1]
             try:
-                self.load_extension(
-                    f'{dirname[2:].replace("/", ".")}.{cog[:-3]}')
-                cogs_text += f"🟢 Loaded {cog[:-3]}\n"
+                self.load_extension(name)
+                cogs_text += f"🟢 Loaded {cog}\n"
                 i += 1
             except (ExtensionNotFound, ExtensionAlreadyLoaded, NoEntryPointError, ExtensionFailed) as e:
-                cogs_text += f"🔴 Unable to load {cog[:-3]} | {e}\n"
+                cogs_text += f"🔴 Unable to load {cog} | {e}\n"
 
-        if self.config.ONLINE_LOG_CHANNEL:
-            await self.get_channel(self.config.ONLINE_LOG_CHANNEL).send(embed=embed("Cogs Loaded", f"```{cogs_text}```"))
+        channel = self.get_channel(self.config.ONLINE_LOG_CHANNEL) if self.config.ONLINE_LOG_CHANNEL else None
+        if channel is not None:
+            log = embed("Cogs Loaded", f"```{cogs_text}```")
+            self.outbound.submit(
+                "online_log", lambda: channel.send(embed=log), Priority.HIGH)
 
         printer(
-            "INFO", f"Loaded {i}/{len(cogs)} extensions from {Color.blue(dirname)}")
+            "INFO", f"Loaded {i}/{len(preload)} extensions from {Color.blue(dirname)}, deferred {len(set(self._lazy_extensions.values()))}")
+        profiler.end("extensions")
+        self.dispatch("extensions_loaded")
 
-    async def get_prefix(self, message: discord.Message) -> list:
-        """Override of the default get_prefix command
+    def load_lazy_extension(self, command: str) -> bool:
+        """Loads the deferred extension providing the given command, see :KingBot:load_extensions:.
+
+        Args:
+            command (str): The name or alias of the command.
+
+        Returns:
+            bool: Whether or not an extension was loaded.
+        """
+        name = self._lazy_extensions.get(command)
+        if name is None:
+            return False
+
+        for key in [key for key, value in self._lazy_extensions.items() if value == name]:
+            del self._lazy_extensions[key]
+        try:
+            self.load_extension(name)
+        except (ExtensionNotFound, ExtensionAlreadyLoaded, NoEntryPointError, ExtensionFailed) as e:
+            printer("ERROR", f"Unable to load {name} | {e}")
+            return False
+
+        printer("INFO", f"Loaded deferred extension {Color.blue(name)}")
+        return True
+
+    def load_lazy_extensions(self) -> None:
+        """Loads every deferred extension, e.g. before listing all commands."""
+        for command in list(self._lazy_extensions):
+            self.load_lazy_extension(command)
 
-        Prefix fetching is done on a cache-first strategy.
+    async def get_context(self, message: discord.Message, *, cls=Context) -> Context:
+        """Override of the default get_context which loads the deferred extension of the invoked command first.
 
         Args:
-            `message (discord.Message)`: The message context to get the prefix of.
+            message (discord.Message): The message to get the invocation context from.
+            cls (type, optional): The class of the context. Defaults to Context.
 
         Returns:
-            :class:`str`: A single prefix that the bot is listening for
+            Context: The invocation context.
         """
-        if not message.guild:
-            printer("ERROR", "NO GUILD FOUND FOR MESSAGE")
-            return [self.config.PREFIX]
+        ctx = await super().get_context(message, cls=cls)
+        if ctx.command is None and self.load_lazy_extension(ctx.invoked_with):
+            ctx = await super().get_context(message, cls=cls)
+        return ctx
+
+    async def _resolve_prefixes(self, guild_id: int) -> tuple:
+        """Looks up the prefixes of the guild in the storage.
 
-        guild_id = message.guild.id
+        Args:
+            guild_id (int): The ID of the guild.
 
+        Returns:
+            tuple: The prefixes the guild is listening for, see :PrefixRecord:.
+        """
         # finds prefix that matches the messsage guild ID
         q = await self._prefixes.find_one({"_id": guild_id})
         if q:
-            prefixes = q.get("prefixes")
+            prefixes = q.prefixes
             if prefixes:
                 return prefixes
 
         raise TypeError(colorify("ERROR", "command_prefix must be plain string, iterable of strings, or callable "
                         "returning either of these, not {}".format(q.__class__.__name__)))
 
+    async def get_prefix(self, message: discord.Message) -> list:
+        """Override of the default get_prefix command
+
+        Prefix fetching is done on a cache-first strategy, through the guild settings.
+        The settings already resolved by `on_message` for the message are reused.
+
+        Args:
+            `message (discord.Message)`: The message context to get the prefix of.
+
+        Returns:
+            :class:`str`: A single prefix that the bot is listening for
+        """
+        if not message.guild:
+            printer("ERROR", "NO GUILD FOUND FOR MESSAGE")
+            return [self.config.PREFIX]
+
+        settings = current_settings.get()
+        if settings is None or settings.guild_id != message.guild.id:
+            settings = await self.guild_settings.get(message.guild.id)
+        return list(settings.prefixes)
+
     async def start(self, *args, **kwargs) -> None:
         """
         Overridden start which ensures cog load and other pre-connection tasks are handled
         """
         init_events(self)
+        await self.config.start()
+        # ended by on_ready
+        profiler.begin("gateway")
         return await super().start(self.config.BOT_TOKEN, *args, **kwargs)
+
+    async def close(self) -> None:
+        """
+        Overridden close which flushes the local storage and disconnects the cache bus before disconnecting
+        """
+        await self.outbound.close()
+        await self.config.close()
+        return await super().close()
@@ -0,0 +1,250 @@
+from abc import ABC, abstractmethod
+import asyncio
+import fcntl
+import json
+import os
+from pathlib import Path
+from typing import Callable, Optional
+from .utils.color import colorify, printer
+
+
+class CacheBus(ABC):
+    """Common class that represents a channel for publishing cache changes to every process sharing the same database.
+
+    A message is a dictionary with the `channel` (name of the manager), `origin` (id of the publishing manager),
+    `key` and `value` of the change. A `value` of None only invalidates the key.
+    """
+
+    def __init__(self) -> None:
+        self._subscribers: dict = {}
+
+    def subscribe(self, channel: str, callback: Callable[[dict], None]) -> None:
+        """Registers a callback for every message published on the channel, including local ones.
+
+        Args:
+            channel (str): The name of the channel to listen to.
+            callback (Callable[[dict], None]): The function called with each message.
+        """
+        self._subscribers.setdefault(channel, []).append(callback)
+
+    def _deliver(self, message: dict) -> None:
+        for callback in self._subscribers.get(message.get("channel"), []):
+            try:
+                callback(message)
+            except Exception as e:
+                printer("ERROR", f"CACHE BUS SUBSCRIBER FAILED: {e}")
+
+    async def publish(self, channel: str, origin: str, key: str, value: Optional[dict]) -> None:
+        """Publishes a cache change to every subscriber of the channel.
+
+        Args:
+            channel (str): The name of the channel to publish on.
+            origin (str): The id of the publisher, so it can ignore its own messages.
+            key (str): The cache key that changed.
+            value (Optional[dict]): The new value, or None to only invalidate the key.
+        """
+        message = {"channel": channel, "origin": origin,
+                   "key": key, "value": value}
+        self._deliver(message)
+        await self._send(message)
+
+    async def start(self) -> None:
+        """Connects the bus, must be called from within the running event loop."""
+
+    async def close(self) -> None:
+        """Disconnects the bus."""
+
+    @abstractmethod
+    async def _send(self, message: dict) -> None:
+        raise NotImplementedError()
+
+
+class LocalCacheBus(CacheBus):
+    """Bus that only delivers messages to subscribers within the current process."""
+
+    async def _send(self, message: dict) -> None:
+        return
+
+
+class UnixSocketCacheBus(CacheBus):
+    """Bus that relays messages between processes on the same machine through a Unix domain socket.
+
+    The first process to start listens on the socket and relays every message it receives to the
+    other connected processes. If that process goes away the others reconnect, one of them taking over.
+    The hub holds an exclusive lock on a file next to the socket until it closes or dies, so only the
+    process getting the lock may remove the socket and listen on it.
+    """
+
+    retry_delay = 1.0
+    # upper bound for a single message, blacklist entries can be large
+    limit = 2 ** 24
+
+    def __init__(self, path: Path) -> None:
+        super().__init__()
+        self.path = Path(path)
+        self.lock_path = self.path.with_name(self.path.name + ".lock")
+        self._lock_fd: Optional[int] = None
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._clients: set = set()
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._reader_task: Optional[asyncio.Task] = None
+        self._retry_task: Optional[asyncio.Task] = None
+        self._closed = False
+
+    @property
+    def is_hub(self) -> bool:
+        return self._server is not None
+
+    async def start(self) -> None:
+        """Connects to the hub or becomes it. If neither is possible yet, e.g. while another process is
+        taking over, it is retried in the background and the caller goes on without the bus meanwhile."""
+        self._closed = False
+        if not await self._connect():
+            self._retry()
+
+    async def _connect(self) -> bool:
+        """Makes a single attempt at connecting to the hub, or at taking over if nobody is listening.
+
+        Returns:
+            bool: Whether or not the bus is now connected or the hub.
+        """
+        try:
+            reader, self._writer = await asyncio.open_unix_connection(str(self.path), limit=self.limit)
+        except (FileNotFoundError, ConnectionRefusedError):
+            if not self._lock_hub():
+                # another process is the hub or is taking over, its socket must not be removed
+                return False
+            # nobody is listening, remove a stale socket left by a crashed process and take over
+            try:
+                os.unlink(self.path)
+            except FileNotFoundError:
+                pass
+            try:
+                self._server = await asyncio.start_unix_server(self._handle_client, str(self.path), limit=self.limit)
+            except OSError as e:
+                printer("ERROR", f"CACHE BUS FAILED TO LISTEN ON {self.path}: {e}")
+                self._unlock_hub()
+                return False
+            printer("INFO", f"CACHE BUS LISTENING ON {self.path}")
+            return True
+
+        self._reader_task = asyncio.ensure_future(self._read_hub(reader))
+        printer("INFO", f"CACHE BUS CONNECTED TO {self.path}")
+        return True
+
+    def _lock_hub(self) -> bool:
+        fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+        self._lock_fd = fd
+        return True
+
+    def _unlock_hub(self) -> None:
+        if self._lock_fd is not None:
+            # closing the descriptor releases the lock
+            os.close(self._lock_fd)
+            self._lock_fd = None
+
+    def _retry(self) -> None:
+        if self._retry_task is None or self._retry_task.done():
+            self._retry_task = asyncio.ensure_future(self._reconnect())
+
+    async def _reconnect(self) -> None:
+        while not self._closed:
+            await asyncio.sleep(self.retry_delay)
+            if await self._connect():
+                return
+
+    async def _read_hub(self, reader: asyncio.StreamReader) -> None:
+        try:
+            async for line in reader:
+                self._deliver(json.loads(line))
+        except (ConnectionError, ValueError) as e:
+            printer("ERROR", f"CACHE BUS FAILED TO READ: {e}")
+        finally:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+            if not self._closed:
+                printer("ERROR", "CACHE BUS LOST CONNECTION, RECONNECTING")
+                self._retry()
+
+    async def _handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self._clients.add(writer)
+        try:
+            async for line in reader:
+                self._deliver(json.loads(line))
+                await self._relay(line, skip=writer)
+        except (ConnectionError, ValueError) as e:
+            printer("ERROR", f"CACHE BUS DROPPED A CLIENT: {e}")
+        finally:
+            self._clients.discard(writer)
+            writer.close()
+
+    async def _relay(self, line: bytes, skip: Optional[asyncio.StreamWriter] = None) -> None:
+        for writer in list(self._clients):
+            if writer is skip:
+                continue
+            try:
+                writer.write(line)
+                await writer.drain()
+            except ConnectionError:
+                self._clients.discard(writer)
+
+    async def _send(self, message: dict) -> None:
+        line = json.dumps(message).encode() + b"\n"
+        if self.is_hub:
+            return await self._relay(line)
+        if self._writer is None:
+            printer("ERROR", "CACHE BUS IS NOT CONNECTED, DROPPING MESSAGE")
+            return
+        try:
+            self._writer.write(line)
+            await self._writer.drain()
+        except ConnectionError as e:
+            printer("ERROR", f"CACHE BUS FAILED TO SEND: {e}")
+
+    async def close(self) -> None:
+        self._closed = True
+        if self._retry_task is not None:
+            self._retry_task.cancel()
+        if self._reader_task is not None:
+            self._reader_task.cancel()
+        if self._writer is not None:
+            self._writer.close()
+        for writer in list(self._clients):
+            writer.close()
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+            try:
+                os.unlink(self.path)
+            except FileNotFoundError:
+                pass
+            self._unlock_hub()
+
+
+def make_bus(kind: str, path: Path) -> CacheBus:
+    """Creates the cache bus configured by `cache_bus`.
+
+    Args:
+        kind (str): Either `local` or `unix`.
+        path (Path): The socket path used by the `unix` bus.
+
+    Raises:
+        TypeError: Raised when the kind of bus is unknown.
+
+    Returns:
+        CacheBus: The new bus.
+    """
+    if kind == "local":
+        return LocalCacheBus()
+    elif kind == "unix":
+        return UnixSocketCacheBus(path)
+
+    raise TypeError(
+        colorify("ERROR", f"Unknown cache_bus {kind}, expected local or unix"))
@@ -0,0 +1,236 @@
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from cachetools import LFUCache, LRUCache, TTLCache
+from .utils.color import colorify
+
+
+class CacheStats:
+    """Mixin recording hits, misses and evictions of a cache.
+
+    Hits and misses are counted by `get`, which is what the managers look entries up with.
+    Evictions are counted by `popitem`, which the caches call whenever they are full.
+    """
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        if key in self:
+            self.hits += 1
+            return self[key]
+        self.misses += 1
+        return default
+
+    def popitem(self):
+        item = super().popitem()
+        self.evictions += 1
+        return item
+
+    def resize(self, maxsize: int) -> None:
+        """Changes the maximum number of entries in place, evicting by the policy of the cache if it shrinks.
+
+        Args:
+            maxsize (int): The new maximum number of entries.
+        """
+        # cachetools has no public setter, the entries are kept rather than rebuilding the cache cold
+        self._Cache__maxsize = maxsize
+        while self.currsize > maxsize:
+            self.popitem()
+
+    @property
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "policy": self.policy,
+            "size": len(self),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+class StatsLRUCache(CacheStats, LRUCache):
+    """Least recently used eviction."""
+    policy = "lru"
+
+
+class StatsLFUCache(CacheStats, LFUCache):
+    """Least frequently used eviction."""
+    policy = "lfu"
+
+
+class StatsTTLCache(CacheStats, TTLCache):
+    """Least recently used eviction, and entries expire `ttl` seconds after they were set."""
+    policy = "ttl"
+
+
+class FrequencySketch:
+    """Count-min sketch estimating how often keys were seen recently.
+
+    Counters saturate at 15 and are halved once `sample_size` keys were recorded, so old popularity fades.
+    """
+
+    depth = 4
+
+    def __init__(self, maxsize: int) -> None:
+        self.width = 1 << max(4, (maxsize * 4 - 1).bit_length())
+        self.sample_size = max(10 * maxsize, 16)
+        self._rows = [bytearray(self.width) for _ in range(self.depth)]
+        self._additions = 0
+
+    def _indexes(self, key):
+        h = hash(key)
+        for i in range(self.depth):
+            yield hash((h, i)) & (self.width - 1)
+
+    def increment(self, key) -> None:
+        for row, i in zip(self._rows, self._indexes(key)):
+            if row[i] < 15:
+                row[i] += 1
+
+        self._additions += 1
+        if self._additions >= self.sample_size:
+            self._additions //= 2
+            for row in self._rows:
+                for i in range(self.width):
+                    row[i] >>= 1
+
+    def estimate(self, key) -> int:
+        return min(row[i] for row, i in zip(self._rows, self._indexes(key)))
+
+
+class TinyLFUCache(MutableMapping):
+    """W-TinyLFU eviction.
+
+    New entries go into a small LRU window. An entry leaving the window is only admitted into the
+    main LRU region if the frequency sketch says it is used more often than the entry it would evict,
+    so one-off guilds cannot push out guilds that are used all the time.
+    """
+
+    policy = "tinylfu"
+
+    def __init__(self, maxsize: int) -> None:
+        self.__maxsize = maxsize
+        self._window: OrderedDict = OrderedDict()
+        self._main: OrderedDict = OrderedDict()
+        self._sketch = FrequencySketch(maxsize)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def maxsize(self) -> int:
+        return self.__maxsize
+
+    @property
+    def currsize(self) -> int:
+        return len(self)
+
+    @property
+    def _window_size(self) -> int:
+        return max(1, self.maxsize // 100)
+
+    def __getitem__(self, key):
+        self._sketch.increment(key)
+        for region in (self._window, self._main):
+            if key in region:
+                region.move_to_end(key)
+                return region[key]
+        raise KeyError(key)
+
+    def __setitem__(self, key, value) -> None:
+        for region in (self._window, self._main):
+            if key in region:
+                region[key] = value
+                region.move_to_end(key)
+                return
+
+        self._sketch.increment(key)
+        self._window[key] = value
+        while len(self._window) > self._window_size:
+            self._admit(*self._window.popitem(last=False))
+
+    def _admit(self, key, value) -> None:
+        if len(self._main) < self.maxsize - self._window_size:
+            self._main[key] = value
+            return
+
+        self.evictions += 1
+        victim = next(iter(self._main), None)
+        if victim is None or self._sketch.estimate(key) <= self._sketch.estimate(victim):
+            return
+        del self._main[victim]
+        self._main[key] = value
+
+    def __delitem__(self, key) -> None:
+        if key in self._window:
+            del self._window[key]
+        else:
+            del self._main[key]
+
+    def __contains__(self, key) -> bool:
+        return key in self._window or key in self._main
+
+    def __iter__(self):
+        yield from list(self._window)
+        yield from list(self._main)
+
+    def __len__(self) -> int:
+        return len(self._window) + len(self._main)
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}({dict(self)!r}, maxsize={self.maxsize})"
+
+    def resize(self, maxsize: int) -> None:
+        """Changes the maximum number of entries in place, evicting from the main region first if it shrinks.
+        The frequency sketch is kept, so the popularity of the remaining entries is not forgotten.
+
+        Args:
+            maxsize (int): The new maximum number of entries.
+        """
+        self.__maxsize = maxsize
+        while len(self) > maxsize:
+            self.popitem()
+
+    def popitem(self):
+        region = self._main if self._main else self._window
+        if not region:
+            raise KeyError(f"{self.__class__.__name__} is empty")
+        self.evictions += 1
+        return region.popitem(last=False)
+
+    get = CacheStats.get
+    stats = CacheStats.stats
+
+
+policies = {
+    cache.policy: cache
+    for cache in (StatsLRUCache, StatsLFUCache, StatsTTLCache, TinyLFUCache)
+}
+
+
+def make_cache(policy: str, maxsize: int, ttl: float = 3600) -> MutableMapping:
+    """Creates a cache with the eviction policy configured by `cache_policy`.
+
+    Args:
+        policy (str): One of `lru`, `lfu`, `ttl` or `tinylfu`.
+        maxsize (int): The maximum number of entries.
+        ttl (float, optional): How long entries live with the `ttl` policy, in seconds. Defaults to 3600.
+
+    Raises:
+        TypeError: Raised when the policy is unknown.
+
+    Returns:
+        MutableMapping: The new cache, with hit, miss and eviction statistics.
+    """
+    if policy not in policies:
+        raise TypeError(
+            colorify("ERROR", f"Unknown cache_policy {policy}, expected one of {list(policies)}"))
+    if policy == "ttl":
+        return StatsTTLCache(maxsize, ttl)
+    return policies[policy](maxsize)
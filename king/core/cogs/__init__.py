@@ -0,0 +1,8 @@
+# The extensions of this package and the top level commands (with aliases) they provide.
+# An extension is imported the first time one of its commands is used, unless it is marked `preload`,
+# e.g. because it replaces the help command or runs background tasks. Extensions missing here are preloaded.
+manifest = {
+    "help": {"commands": ["help", "halp", "helpall", "halpall"], "preload": True},
+    "mod": {"commands": ["blacklist"]},
+    "stats": {"commands": ["metrics"], "preload": True},
+}
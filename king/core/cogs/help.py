@@ -1,12 +1,76 @@
 import itertools
+from cachetools import LRUCache, TTLCache
 from discord import Embed
 from discord.ext import commands
 from discord.ext.commands import HelpCommand, DefaultHelpCommand
 from discord.ext.commands.core import Group
 
 
+class HelpCache:
+    """Rendered help pages, shared by every copy of the help command.
+
+    Pages are kept as the `(category, entries)` fields of their embed. Bot help pages are keyed by the
+    visibility level and the exact set of commands shown, so users who can run the same commands share them.
+    Which commands a user can run is kept separately per channel and user for `check_ttl` seconds, since
+    it depends on their permissions. Everything is dropped whenever an extension is loaded, unloaded or reloaded.
+    The prefix is not part of any key, it only appears in the header and footer which are added when sending.
+    """
+
+    def __init__(self, bot, maxsize: int = 256, check_ttl: float = 60) -> None:
+        self.bot = bot
+        self._generation = None
+        self._pages: LRUCache = LRUCache(maxsize)
+        self._visible: TTLCache = TTLCache(maxsize * 16, check_ttl)
+
+    def __deepcopy__(self, memo):
+        # HelpCommand deep copies its options for every invocation, the cache has to stay shared
+        return self
+
+    def _validate(self) -> None:
+        if self._generation != self.bot.extensions_generation:
+            self._generation = self.bot.extensions_generation
+            self._pages.clear()
+            self._visible.clear()
+
+    async def visible(self, help_command: HelpCommand) -> frozenset:
+        """Returns the qualified names of the commands the invoking user may see, running their checks once per TTL.
+
+        Args:
+            help_command (HelpCommand): The help command being invoked.
+
+        Returns:
+            frozenset: The names of the visible commands.
+        """
+        self._validate()
+        ctx = help_command.context
+        key = (help_command.show_hidden, ctx.channel.id, ctx.author.id)
+        visible = self._visible.get(key)
+        if visible is None:
+            filtered = await help_command.filter_commands(ctx.bot.commands)
+            visible = self._visible[key] = frozenset(
+                command.qualified_name for command in filtered)
+        return visible
+
+    def pages(self, key: tuple, render) -> list:
+        """Returns the fields of a help page, rendering them on the first call.
+
+        Args:
+            key (tuple): What the page depends on, e.g. the visibility level and the commands shown.
+            render (Callable[[], list]): Builds the `(category, entries)` fields of the page.
+
+        Returns:
+            list: The fields of the page.
+        """
+        self._validate()
+        pages = self._pages.get(key)
+        if pages is None:
+            pages = self._pages[key] = render()
+        return pages
+
+
 class KingHelp(HelpCommand):
     def __init__(self, **options):
+        self.cache: HelpCache = options.pop("cache")
         super().__init__(**options)
         self.paginator = None
         self.spacer = "\u1160 "
@@ -42,17 +106,14 @@ class KingHelp(HelpCommand):
             )
         await destination.send(embed=embed)
 
-    async def send_bot_help(self, destination=None):
-        ctx = self.context
-        bot = ctx.bot
-
+    def _render_bot_help(self, visible: frozenset) -> list:
         def get_category(command):
             cog = command.cog
             return cog.qualified_name + ':' if cog is not None else 'Help:'
 
-        filtered = await self.filter_commands(
-            bot.commands,
-            sort=True,
+        pages = []
+        filtered = sorted(
+            (command for command in self.context.bot.commands if command.qualified_name in visible),
             key=get_category
         )
         to_iterate = itertools.groupby(filtered, key=get_category)
@@ -68,30 +129,31 @@ class KingHelp(HelpCommand):
                     entries += ' **|** '.join([cmd.name for cmd in cmds[0:8]])
                     cmds = cmds[8:]
                     entries += '\n' if cmds else ''
-            self.paginator.append((category, entries))
-        await self.send_pages(header=True, footer=True, destination=destination)
+            pages.append((category, entries))
+        return pages
 
-    async def send_command_help(self, command):
+    async def send_bot_help(self, destination=None):
+        visible = await self.cache.visible(self)
+        self.paginator.extend(self.cache.pages(
+            ("bot", self.show_hidden, visible), lambda: self._render_bot_help(visible)))
+        await self.send_pages(header=True, footer=True, destination=destination)
 
+    def _render_command_help(self, command) -> list:
         # add the usage text [REQUIRED]
         usage = command.usage if command.usage else "`None`"
-        self.paginator.append(
-            ("❯ Usage",  usage)
-        )
 
         # add examples text [REQUIRED]
         examples = command.brief if command.brief else "`None`"
-        self.paginator.append(
-            ("❯ Examples",  examples)
-        )
 
         # add aliases text [REQUIRED]
         aliases = " **|** ".join(
             f'`{alias}`' for alias in command.aliases) if command.aliases else "None"
 
-        self.paginator.append(
-            ("❯ Aliases",  aliases)
-        )
+        return [("❯ Usage",  usage), ("❯ Examples",  examples), ("❯ Aliases",  aliases)]
+
+    async def send_command_help(self, command):
+        self.paginator.extend(self.cache.pages(
+            ("command", command.qualified_name), lambda: self._render_command_help(command)))
 
         await self.send_pages(title=(command.name.title(), command.help), footer=True)
 
@@ -112,6 +174,8 @@ class KingHelp(HelpCommand):
     async def command_callback(self, ctx, *, command=None):
         await self.prepare_help_command(ctx, command)
         bot = ctx.bot
+        # every command is listed, including those of extensions that were not used yet
+        bot.load_lazy_extensions()
 
         if command is None:
             return await self.send_error_message()
@@ -152,7 +216,11 @@ class KingHelp(HelpCommand):
 class Help(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
+        self.cache = HelpCache(bot)
+        # used by helpall, so the help command of the bot never has to be swapped
+        self.all_help = KingHelp(cache=self.cache, show_hidden=True)
         self.bot.help_command = KingHelp(
+            cache=self.cache,
             command_attrs={
                 'aliases': ['halp'],
                 'help': 'Shows help about the bot, a command, or a category',
@@ -173,12 +241,9 @@ class Help(commands.Cog):
     )
     async def helpall(self, ctx, *, text=None):
         """Print bot help including all hidden commands."""
-        self.bot.help_command = KingHelp(show_hidden=True)
-        if text:
-            await ctx.send_help(text)
-        else:
-            await ctx.send_help()
-        self.bot.help_command = KingHelp()
+        help_command = self.all_help.copy()
+        help_command.context = ctx
+        await help_command.command_callback(ctx, command=text or 'help')
 
 
 def setup(bot):
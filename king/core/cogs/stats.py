@@ -0,0 +1,87 @@
+from pathlib import Path
+from discord.ext import commands, tasks
+from ..bot import KingBot
+from ..metrics import metrics
+from ..utils.color import printer
+from ..utils.embed import embed
+
+
+def _ms(seconds: float) -> str:
+    return "∞" if seconds == float("inf") else f"{seconds * 1000:.2f}ms"
+
+
+class Stats(commands.Cog):
+
+    def __init__(self, bot: KingBot):
+        self.bot = bot
+        self.path = Path(self.bot.config.METRICS_PATH)
+        if self.bot.config.METRICS_EXPORT_INTERVAL:
+            self.export_loop.change_interval(
+                seconds=self.bot.config.METRICS_EXPORT_INTERVAL)
+            self.export_loop.start()
+
+    def cog_unload(self):
+        self.export_loop.cancel()
+
+    async def cog_check(self, ctx):
+        return await self.bot.is_owner(ctx.author)
+
+    @tasks.loop(seconds=60)
+    async def export_loop(self):
+        await self.bot.loop.run_in_executor(None, metrics.write_prometheus, self.path)
+
+    @export_loop.error
+    async def export_loop_error(self, error):
+        printer("ERROR", f"FAILED TO EXPORT METRICS TO {self.path}: {error}")
+
+    @commands.group(invoke_without_command=True, hidden=True)
+    async def metrics(self, ctx) -> None:
+        """Shows the hit/miss counts and latencies of each storage layer and message stage."""
+        lines = [f"{'LAYER':<9}{'COLLECTION':<11}{'HITS':>8}{'MISSES':>8}{'P50':>10}{'P99':>10}"]
+        for layer, collection, hits, misses, p50, p99 in metrics.lookup_summary():
+            lines.append(
+                f"{layer:<9}{collection:<11}{hits:>8}{misses:>8}{_ms(p50):>10}{_ms(p99):>10}")
+        lines.append(
+            f"{'STAGE':<17}{'PASSED':>9}{'DROPPED':>9}{'P50':>10}{'P99':>10}")
+        for stage, passed, dropped, p50, p99 in metrics.stage_summary():
+            lines.append(
+                f"{stage:<17}{passed:>9}{dropped:>9}{_ms(p50):>10}{_ms(p99):>10}")
+        for name, storage in (("prefix", self.bot.config.prefixes), ("blacklist", self.bot.config.blacklist)):
+            stats = storage.cache_stats
+            lines.append(
+                f"{name} cache: {stats['policy']} {stats['size']}/{stats['maxsize']}, hit rate {stats['hit_rate']:.1%}, {stats['evictions']} evictions")
+        stats = self.bot.config.blacklist_filter.stats
+        lines.append(
+            f"blacklist filter: {stats['rejected']}/{stats['checks']} rejected, {stats['false_positives']} false positives")
+        dropped = {dict(labels)["scope"]: value for (name, labels), value in metrics.counters.items()
+                   if name == "king_ratelimited_messages_total"}
+        lines.append(
+            f"rate limiter: {dropped.get('user', 0)} user / {dropped.get('guild', 0)} guild messages dropped")
+        calls = {}
+        for (name, labels), value in metrics.counters.items():
+            if name == "king_outbound_calls_total":
+                result = dict(labels)["result"]
+                calls[result] = calls.get(result, 0) + value
+        lines.append(
+            f"outbound: {len(self.bot.outbound)} queued, " + ", ".join(f"{count} {result}" for result, count in sorted(calls.items())))
+        await ctx.send(embed=embed("Storage Metrics", "```" + "\n".join(lines) + "```"))
+
+    @metrics.command(name="memory")
+    async def metrics_memory(self, ctx) -> None:
+        """Shows how many bytes each cached guild costs."""
+        lines = [f"{'CACHE':<11}{'ENTRIES':>9}{'KEYS':>10}{'RECORDS':>11}{'PER GUILD':>11}"]
+        for name, storage in (("prefix", self.bot.config.prefixes), ("blacklist", self.bot.config.blacklist)):
+            usage = storage.memory_usage()
+            lines.append(
+                f"{name:<11}{usage['entries']:>9}{usage['key_bytes']:>10}{usage['record_bytes']:>11}{usage['bytes_per_guild']:>10.1f}B")
+        await ctx.send(embed=embed("Cache Memory", "```" + "\n".join(lines) + "```"))
+
+    @metrics.command(name="export")
+    async def metrics_export(self, ctx) -> None:
+        """Writes the metrics to the Prometheus text file."""
+        await self.bot.loop.run_in_executor(None, metrics.write_prometheus, self.path)
+        await ctx.send(f"Exported metrics to `{self.path}`")
+
+
+def setup(bot):
+    bot.add_cog(Stats(bot))
@@ -1,34 +1,112 @@
+import asyncio
 from pathlib import Path
-from typing import Union
-import motor.motor_asyncio as motor
+import time
+from typing import Callable, Iterable, Optional, Union
 import yaml
-from .errors import CacheNotFoundError, DatabaseNotFoundError
+from .bus import CacheBus, make_bus
+from .cache_policies import policies
+from .metrics import metrics
+from .persistence import atomic_write
+from .profiler import profiler
+from .records import BlacklistRecord
 from .settings_db import BlacklistDatabase, PrefixDatabase
 from .settings_caches import BlacklistManager, PrefixManager
-from .utils.color import colorify, printer
+from .sharding import ShardPartition
+from .snapshot import formats
+from .utils.bloom import BlacklistFilter
+from .utils.color import LOG_LEVELS, colorify, configure_logging, printer
 
 
 class Config:
+    # options applied by :Config:reload: while the bot runs and their defaults, every other option needs a restart
+    reloadable = {"cache_size": 100, "prefix": "!", "online_log_channel": None,
+                  "guild_join_batch_interval": 1.0, "log_level": "data", "log_color": None,
+                  "log_max_length": 2000, "dm_notice_window": 3600, "mention_reply_window": 30,
+                  "owner_digest_interval": 60}
+
     def __init__(self, config_path: Path) -> None:
+        profiler.begin("config.parse")
+        self._path = Path(config_path)
         # load config yaml file
         with open(config_path) as stream:
-            _config: dict = yaml.load(stream, Loader=yaml.FullLoader)
+            text = stream.read()
+            _config: dict = yaml.load(text, Loader=yaml.FullLoader)
             config: dict = _config.copy()  # keeping copy of config
 
         # BASE CONFIGURATION
         self.NAME: str = config.pop("name", "KingBot")
         self.BOT_TOKEN: str = config.pop("bot_token", None)
-        self.CACHE_SIZE: int = config.pop("cache_size", 100)
+        self.CACHE_SIZE: int = config.pop(
+            "cache_size", self.reloadable["cache_size"])
+        self.CACHE_POLICY: str = config.pop("cache_policy", "lfu")
+        self.CACHE_TTL: float = config.pop("cache_ttl", 3600)
+        self.NEGATIVE_CACHE_SIZE: int = config.pop(
+            "negative_cache_size", 1000)
+        self.NEGATIVE_CACHE_TTL: int = config.pop("negative_cache_ttl", 300)
+        self.SNAPSHOT_INTERVAL: float = config.pop("snapshot_interval", 1.0)
+        self.STORAGE_FORMAT: str = config.pop("storage_format", "yaml")
+        self.BLACKLIST_FILTER_ERROR_RATE: float = config.pop(
+            "blacklist_filter_error_rate", 0.01)
         self.MONGO_DB_URI: str = config.pop("mongo_db_uri", None)
-        self.PREFIX: str = config.pop("prefix", "!")
+        self.WRITE_BATCH_SIZE: int = config.pop("write_batch_size", 100)
+        self.WRITE_FLUSH_INTERVAL: float = config.pop(
+            "write_flush_interval", 1.0)
+        self.SYNC_BATCH_SIZE: int = config.pop("sync_batch_size", 1000)
+        self.RATE_LIMIT_USER_RATE: float = config.pop(
+            "rate_limit_user_rate", 1.0)
+        self.RATE_LIMIT_USER_BURST: float = config.pop(
+            "rate_limit_user_burst", 5)
+        self.RATE_LIMIT_GUILD_RATE: float = config.pop(
+            "rate_limit_guild_rate", 50.0)
+        self.RATE_LIMIT_GUILD_BURST: float = config.pop(
+            "rate_limit_guild_burst", 100)
+        self.RATE_LIMIT_SWEEP_INTERVAL: float = config.pop(
+            "rate_limit_sweep_interval", 60)
+        self.OUTBOUND_RATE: float = config.pop("outbound_rate", 5.0)
+        self.OUTBOUND_BURST: float = config.pop("outbound_burst", 10)
+        self.OUTBOUND_QUEUE_SIZE: int = config.pop("outbound_queue_size", 500)
+        self.DM_NOTICE_WINDOW: float = config.pop(
+            "dm_notice_window", self.reloadable["dm_notice_window"])
+        self.MENTION_REPLY_WINDOW: float = config.pop(
+            "mention_reply_window", self.reloadable["mention_reply_window"])
+        self.OWNER_DIGEST_INTERVAL: float = config.pop(
+            "owner_digest_interval", self.reloadable["owner_digest_interval"])
+        self.MESSAGE_STAGE_COSTS: dict = config.pop(
+            "message_stage_costs", {})
+        self.CONFIG_RELOAD_INTERVAL: float = config.pop(
+            "config_reload_interval", 5.0)
+        self.GUILD_JOIN_BATCH_INTERVAL: float = config.pop(
+            "guild_join_batch_interval", self.reloadable["guild_join_batch_interval"])
+        self.PREFIX: str = config.pop("prefix", self.reloadable["prefix"])
         self.OWNER: int = config.pop("owner", 155780111197536256)
-        self.ONLINE_LOG_CHANNEL: int = config.pop("online_log_channel", None)
+        self.ONLINE_LOG_CHANNEL: int = config.pop(
+            "online_log_channel", self.reloadable["online_log_channel"])
+        self.METRICS_PATH: str = config.pop(
+            "metrics_path", "core/data/metrics.prom")
+        self.METRICS_EXPORT_INTERVAL: float = config.pop(
+            "metrics_export_interval", 60)
+        self.LOG_LEVEL: str = config.pop(
+            "log_level", self.reloadable["log_level"])
+        self.LOG_COLOR: bool = config.pop(
+            "log_color", self.reloadable["log_color"])
+        self.LOG_MAX_LENGTH: int = config.pop(
+            "log_max_length", self.reloadable["log_max_length"])
         self.SCOPES: list = config.pop("scopes", ["bot"])
         self.PERMISSIONS: int = config.pop("permissions", 8526491377)
+        self.SHARD_IDS: list = config.pop("shard_ids", None)
+        self.SHARD_COUNT: int = config.pop("shard_count", None)
+        self.CACHE_BUS: str = config.pop("cache_bus", "local")
+        self.CACHE_BUS_PATH: str = config.pop(
+            "cache_bus_path", "core/data/cache_bus.sock")
+
+        self._check_log_level(self.LOG_LEVEL)
+        configure_logging(self.LOG_LEVEL, self.LOG_COLOR, self.LOG_MAX_LENGTH)
 
         if self.MONGO_DB_URI:  # if MONGO_DB_URI is provided
+            # only imported when a database is configured, it is one of the slowest imports of the bot
+            from motor.motor_asyncio import AsyncIOMotorClient
             config.update({"local": False})
-            self.CLUSTER = motor.AsyncIOMotorClient(
+            self.CLUSTER = AsyncIOMotorClient(
                 self.MONGO_DB_URI)[self.NAME]
         else:
             config.update({"local": True})
@@ -40,6 +118,22 @@ class Config:
         self.BLACKLIST: list = config.pop("blacklist", None)
         self.LOCAL: bool = config.pop("local")
 
+        if self.CACHE_POLICY not in policies:
+            raise TypeError(
+                colorify(
+                    "ERROR",
+                    f"Unknown cache_policy {self.CACHE_POLICY}, expected one of {list(policies)}"
+                )
+            )
+
+        if self.STORAGE_FORMAT not in formats:
+            raise TypeError(
+                colorify(
+                    "ERROR",
+                    f"Unknown storage_format {self.STORAGE_FORMAT}, expected one of {list(formats)}"
+                )
+            )
+
         # Raises to prevent any additional unwanted variables
         if config:  # if it has been previously set
             raise TypeError(
@@ -49,20 +143,50 @@ class Config:
                 )
             )
 
-        with open(config_path, "w") as stream:
-            yaml.safe_dump(_config, stream)
+        # only rewritten when something was added, so the watcher does not see its own write
+        dumped = yaml.safe_dump(_config)
+        if dumped != text:
+            atomic_write(self._path, dumped)
+        self._mtime: float = self._path.stat().st_mtime
+        self._file: dict = _config
 
         self.__dict__.update(_config)
+        profiler.end("config.parse")
 
-        if self.LOCAL:
-            self._prefixes = PrefixManager(self.__dict__.copy())
-            self._blacklist = BlacklistManager(self.__dict__.copy())
-        else:
-            self._prefixes = PrefixDatabase(self.__dict__.copy())
-            self._blacklist = BlacklistDatabase(self.__dict__.copy())
+        # shared with the managers through the config, like CLUSTER
+        self.BUS: CacheBus = make_bus(self.CACHE_BUS, self.CACHE_BUS_PATH)
+        self.PARTITION: ShardPartition = ShardPartition(
+            self.SHARD_IDS, self.SHARD_COUNT)
+
+        with profiler.phase("storage"):
+            if self.LOCAL:
+                self._prefixes = PrefixManager(self.__dict__.copy())
+                self._blacklist = BlacklistManager(self.__dict__.copy())
+            else:
+                self._prefixes = PrefixDatabase(self.__dict__.copy())
+                self._blacklist = BlacklistDatabase(self.__dict__.copy())
 
         printer("DATA", f"STORAGE IS LOCAL?: {self.LOCAL}")
 
+        # lets is_blacklisted skip the storage for users who are certainly not blacklisted, it is seeded
+        # from the synced storage and kept up to date by its listeners, like the caches
+        with profiler.phase("blacklist_filter"):
+            self._blacklist_filter = BlacklistFilter.from_storage(
+                self._blacklist.snapshot(), self.BLACKLIST_FILTER_ERROR_RATE)
+        self._blacklist.add_listener(self._blacklist_filter.add_entry)
+        printer(
+            "DATA", f"BLACKLIST FILTER BUILT WITH {self._blacklist_filter.stats['entries']} ENTRIES")
+
+        metrics.add_collector(self._collect_metrics)
+
+        # called with the applied changes after every reload
+        self._reload_listeners: list = []
+        self._watcher: Optional[asyncio.Task] = None
+
+        # guilds waiting to be registered together, see :Config:register_guild_default:
+        self._joins: set = set()
+        self._joins_registered: Optional[asyncio.Future] = None
+
     @property
     def prefixes(self) -> Union[PrefixManager, PrefixDatabase]:
         return self._prefixes
@@ -71,72 +195,232 @@ class Config:
     def blacklist(self) -> Union[BlacklistManager, BlacklistDatabase]:
         return self._blacklist
 
-    async def register_guild_default(self, guild_id: int) -> None:
-        exists = False
-        try:
-            exists = await self.prefixes.find_one({"_id": guild_id})
-        except (CacheNotFoundError, DatabaseNotFoundError) as e:
-            print(e)
-        finally:
-            if not exists:
-                printer("INFO", f"REGISTERED GUILD {guild_id}")
-                return await self.prefixes.insert_one(
-                    guild_id,
-                    {"prefixes": [self.PREFIX]},
-                )
+    @property
+    def blacklist_filter(self) -> BlacklistFilter:
+        return self._blacklist_filter
+
+    def _collect_metrics(self) -> list:
+        """Gauges of the caches, the blacklist filter and the write queues, see :Metrics:add_collector:.
+
+        Returns:
+            list: The `(name, labels, value)` gauges.
+        """
+        gauges = []
+        for name, storage in (("prefix", self.prefixes), ("blacklist", self.blacklist)):
+            collection = (("collection", name),)
+            for stat, value in storage.cache_stats.items():
+                if stat != "policy":
+                    gauges.append((f"king_cache_{stat}", collection, value))
+            if not self.LOCAL:
+                gauges.append(
+                    ("king_write_queue_depth", collection, storage.queue_depth))
+        for stat, value in self.blacklist_filter.stats.items():
+            gauges.append((f"king_blacklist_filter_{stat}", (), value))
+        return gauges
+
+    def repartition(self, shard_ids: Iterable[int], shard_count: int) -> None:
+        """Restricts the caches to the guilds of the given shards, dropping the entries of every other guild.
+
+        Args:
+            shard_ids (Iterable[int]): The IDs of the shards run by this process.
+            shard_count (int): The total number of shards of the bot.
+        """
+        if not self.PARTITION.update(shard_ids, shard_count):
             return
 
+        dropped = self.prefixes.repartition() + self.blacklist.repartition()
+        printer(
+            "DATA", f"CACHES PARTITIONED TO {self.PARTITION}, DROPPED {dropped} ENTRIES")
+
+    @staticmethod
+    def _check_log_level(level: str) -> None:
+        if str(level).upper() not in LOG_LEVELS:
+            raise TypeError(
+                colorify(
+                    "ERROR",
+                    f"Unknown log_level {level}, expected one of {[level.lower() for level in LOG_LEVELS]}"
+                )
+            )
+
+    def add_reload_listener(self, callback: Callable[[dict], None]) -> None:
+        """Registers a callback for every reload that changed something, see :Config:reload:.
+
+        Args:
+            callback (Callable[[dict], None]): The function called with the applied options and their new values.
+        """
+        self._reload_listeners.append(callback)
+
+    @classmethod
+    def _check_option(cls, key: str, value) -> None:
+        if key == "log_level":
+            return cls._check_log_level(value)
+
+        if key == "prefix":
+            valid = isinstance(value, str) and value != ""
+        elif key in ("online_log_channel", "log_color"):
+            # an ID and a flag, both may be left empty
+            valid = value is None or isinstance(value, int)
+        else:
+            # sizes are counted, every other option is a number of seconds
+            number = int if key in ("cache_size", "log_max_length") else (int, float)
+            # an empty cache cannot admit anything, every insert would raise
+            minimum = 1 if key == "cache_size" else 0
+            valid = isinstance(value, number) and not isinstance(
+                value, bool) and value >= minimum
+        if not valid:
+            raise TypeError(
+                colorify("ERROR", f"Invalid {key}: {value!r}"))
+
+    def reload(self) -> dict:
+        """Applies the options of the config file that changed since it was last read, a removed option
+        goes back to its default. Caches are resized in place and every other option is swapped in a
+        single assignment, nothing is synced again.
+
+        Raises:
+            TypeError: Raised when a changed option is invalid, in which case nothing is applied and
+                the options are compared with the same previous file on the next reload.
+
+        Returns:
+            dict: The applied options and their new values.
+        """
+        with open(self._path) as stream:
+            new: dict = yaml.load(stream, Loader=yaml.FullLoader) or {}
+        changes = {key: value for key, value in new.items()
+                   if self._file.get(key) != value}
+        for key in self._file.keys() - new.keys():
+            changes[key] = self.reloadable.get(key)
+
+        # every value is checked before any is applied, so a bad one leaves the running options untouched
+        for key, value in changes.items():
+            if key in self.reloadable:
+                self._check_option(key, value)
+        self._file = new
+
+        for key in [key for key in changes if key not in self.reloadable]:
+            printer("ERROR", f"{key} CHANGED, RESTART THE BOT TO APPLY IT")
+            del changes[key]
+
+        for key, value in changes.items():
+            setattr(self, key.upper(), value)
+            self.__dict__[key] = value
+        if "cache_size" in changes:
+            self.prefixes.resize(self.CACHE_SIZE)
+            self.blacklist.resize(self.CACHE_SIZE)
+        if {"log_level", "log_color", "log_max_length"} & changes.keys():
+            configure_logging(
+                self.LOG_LEVEL, self.LOG_COLOR, self.LOG_MAX_LENGTH)
+
+        if changes:
+            printer("INFO", f"RELOADED CONFIG: {changes}")
+            for callback in self._reload_listeners:
+                callback(changes)
+        return changes
+
+    async def _watch(self) -> None:
+        while True:
+            await asyncio.sleep(self.CONFIG_RELOAD_INTERVAL)
+            try:
+                mtime = self._path.stat().st_mtime
+                if mtime != self._mtime:
+                    self._mtime = mtime
+                    self.reload()
+            except Exception as e:
+                # the watcher must outlive any bad reload, or the file would never be read again
+                printer("ERROR", f"FAILED TO RELOAD {self._path}: {e}")
+
+    async def start(self) -> None:
+        """Connects the cache bus and starts watching the config file, must be called from within the running event loop.
+        """
+        await self.BUS.start()
+        if self.CONFIG_RELOAD_INTERVAL and self._watcher is None:
+            self._watcher = asyncio.ensure_future(self._watch())
+
+    async def flush(self) -> None:
+        """Writes every pending change of the prefix and blacklist storage to disk.
+        """
+        await self.prefixes.flush()
+        await self.blacklist.flush()
+
+    async def close(self) -> None:
+        """Stops watching the config file, flushes every pending change and disconnects the cache bus.
+        """
+        if self._watcher is not None:
+            self._watcher.cancel()
+            self._watcher = None
+        await self.flush()
+        await self.BUS.close()
+
+    async def register_guilds(self, guild_ids: Iterable[int]) -> int:
+        """Registers the default prefix for every guild that has no prefix entry yet.
+        The stored guilds are looked up once for all of them and the missing ones are written in one batch.
+
+        Args:
+            guild_ids (Iterable[int]): The IDs of the guilds to register, e.g. every guild the bot is in.
+
+        Returns:
+            int: The number of newly registered guilds.
+        """
+        missing = await self.prefixes.missing(guild_ids)
+        if missing:
+            await self.prefixes.insert_many(
+                {guild_id: {"prefixes": [self.PREFIX]} for guild_id in missing})
+            printer("INFO", f"REGISTERED {len(missing)} GUILDS")
+        return len(missing)
+
+    async def register_guild_default(self, guild_id: int) -> None:
+        """Registers the default prefix for the guild if it has none.
+        Guilds registered within `guild_join_batch_interval` seconds of each other are registered together.
+
+        Args:
+            guild_id (int): The ID of the guild.
+        """
+        self._joins.add(guild_id)
+        if self._joins_registered is None:
+            self._joins_registered = asyncio.ensure_future(
+                self._register_joins())
+        await asyncio.shield(self._joins_registered)
+
+    async def _register_joins(self) -> None:
+        await asyncio.sleep(self.GUILD_JOIN_BATCH_INTERVAL)
+        # joins arriving from now on start the next batch
+        guild_ids, self._joins, self._joins_registered = self._joins, set(), None
+        await self.register_guilds(guild_ids)
+
     async def register_blacklisted_user(self, guild_id: int, user_id: int, reason: str) -> None:
         """Registers the user for blacklisting from a specific guild.
+        The users already blacklisted in the guild are kept.
 
         Args:
             guild_id (int): The ID of the guild to blacklist the user from.
             user_id (int): The ID of the user to blacklist.
             reason (str): The reason for the blacklisting.
         """
-        exists = False
-        try:
-            exists = await self.blacklist.find_one({"_id": guild_id})
-
-        except (CacheNotFoundError, DatabaseNotFoundError) as e:
-            print(e)
-
-        finally:
-            if not exists:
-                printer("INFO", f"BLACKLISTED USER {user_id}")
-                return await self.blacklist.insert_one(
-                    guild_id,
-                    {"blacklist": {
-                        str(user_id): {
-                            "reason": reason,
-                        }
-                    }
-                    },
-                )
-            return
+        await self.blacklist.add(guild_id, user_id, {"reason": reason})
+        printer("INFO", f"BLACKLISTED USER {user_id}")
 
-    async def is_blacklisted(self, guild_id: int, user_id: int) -> bool:
+    async def is_blacklisted(self, guild_id: int, user_id: int, record: Optional[BlacklistRecord] = None) -> bool:
         """Checks whether a user is blacklisted for a given guild.
 
         Args:
             guild_id (int): The ID of the guild to check.
             user_id (int): The ID of the user to check.
+            record (Optional[BlacklistRecord], optional): The blacklist of the guild if already resolved, e.g. by :GuildSettings:, so the storage is not asked. Defaults to None.
 
         Returns:
             bool: Whether or not the user is blacklisted.
         """
-        exists = False
-
-        try:
-            exists = await self.blacklist.find_one({"_id": guild_id})
-
-        except (CacheNotFoundError, DatabaseNotFoundError):
-            pass
+        started = time.perf_counter()
+        if not self.blacklist_filter.might_contain(guild_id, user_id):
+            metrics.record_lookup("filter", "blacklist", "hit",
+                                  time.perf_counter() - started)
+            return False
+        metrics.record_lookup("filter", "blacklist", "miss",
+                              time.perf_counter() - started)
 
-        finally:
-            if not exists:  # if no blacklist for guild exists..
-                return False
+        if record is None:
+            record = await self.blacklist.record(guild_id)
+        if user_id in record:
+            return True
 
-            elif str(user_id) in exists.get("blacklist"):
-                return True
-            return False
+        self.blacklist_filter.report_false_positive()
+        return False
@@ -1,14 +1,30 @@
-from art import text2art
 import discord
+from .outbound import Priority
+from .pipeline import MessageState
+from .profiler import profiler
 from .utils.color import printer, Color
 
 
 def init_events(bot):
+    async def register_guilds():
+        # guilds joined while the bot was down never went through on_guild_join
+        try:
+            await bot.config.register_guilds([guild.id for guild in bot.guilds])
+        except Exception as e:
+            printer("ERROR", f"FAILED TO REGISTER THE GUILDS OF THE BOT: {e}")
+
     @bot.event
     async def on_ready():
+        profiler.end("gateway")
         bot.app_info = await bot.application_info()
+        bot.repartition()
+        # not awaited, a storage error must not keep the extensions from loading
+        bot.loop.create_task(register_guilds())
         # await bot.get_blacklisted_users()
-        printer("BANNER", text2art(bot.name))
+        with profiler.phase("banner"):
+            # only needed once, for the banner
+            from art import text2art
+            printer("BANNER", text2art(bot.name))
         printer("INFO", f"Logged in as {Color.blue(bot.user)}")
         printer(
             "INFO", f'Bot-Name: {Color.blue(bot.user.name) + Color.RESET} {Color.yellow("| ID:")} {Color.blue(bot.user.id) + Color.RESET}')
@@ -17,26 +33,68 @@ def init_events(bot):
 
         printer("INFO", f'Invite URL: {Color.blue(bot.invite_url)}')
 
-        await bot.load_extensions('./core/cogs')
+        # not awaited, on_ready returns without waiting for the extensions
+        bot.loop.create_task(bot.load_extensions('./core/cogs'))
 
     @bot.event
-    async def on_message(message: discord.Message):
-        if message.author.bot:
-            return
-        if isinstance(message.channel, discord.DMChannel):
-            await message.author.send(':x: Sorry, but I don\'t accept commands through direct messages! Please use the `#bots` channel of your corresponding server!')
-            return
-        if message.guild:
-            if await bot.config.is_blacklisted(message.guild.id, message.author.id):
-                return
-        if bot.dev and not await bot.is_owner(message.author):
-            return
-        if bot.user.mentioned_in(message) and message.mention_everyone is False:
+    async def on_shard_ready(shard_id: int):
+        bot.repartition()
+
+    pipeline = bot.message_pipeline
+
+    @pipeline.stage("bot_author", cost=0)
+    async def bot_author(state: MessageState) -> bool:
+        return not state.message.author.bot
+
+    @pipeline.stage("direct_message", cost=2)
+    async def direct_message(state: MessageState) -> bool:
+        author = state.message.author
+        if isinstance(state.message.channel, discord.DMChannel):
+            bot.outbound.submit("dm_notice", lambda: author.send(':x: Sorry, but I don\'t accept commands through direct messages! Please use the `#bots` channel of your corresponding server!'),
+                                Priority.LOW, ("dm_notice", author.id), bot.config.DM_NOTICE_WINDOW)
+            return False
+        return True
+
+    @pipeline.stage("command_prefix", cost=10)
+    async def command_prefix(state: MessageState) -> bool:
+        # most messages are neither commands nor mentions, reject them before any other lookup
+        settings = await state.settings()
+        return settings is None or state.mentioned or settings.match_prefix(state.message.content) is not None
+
+    @pipeline.stage("rate_limit", cost=11)
+    async def rate_limit(state: MessageState) -> bool:
+        # throttles spamming users and raided guilds, only commands and mentions are charged, not plain chat
+        message = state.message
+        return bot.rate_limiter.allow(message.guild.id if message.guild else None, message.author.id)
+
+    @pipeline.stage("blacklist", cost=12)
+    async def blacklist(state: MessageState) -> bool:
+        # the blacklist filter answers most checks, the others use the blacklist already resolved with the settings
+        settings = await state.settings()
+        message = state.message
+        return settings is None or not await bot.config.is_blacklisted(message.guild.id, message.author.id, settings.blacklist)
+
+    @pipeline.stage("dev_mode", cost=100)
+    async def dev_mode(state: MessageState) -> bool:
+        return not bot.dev or await bot.is_owner(state.message.author)
+
+    @pipeline.stage("mention", cost=1000, short_circuit=False)
+    async def mention(state: MessageState) -> bool:
+        message = state.message
+        if state.mentioned:
+            window = bot.config.MENTION_REPLY_WINDOW
             if 'help' in message.content.lower():
-                await message.channel.send(f'A full list of all commands is available here using the {bot.default_prefix}help command!')
+                bot.outbound.submit("mention_reply", lambda: message.channel.send(f'A full list of all commands is available here using the {bot.default_prefix}help command!'),
+                                    Priority.NORMAL, ("mention_reply", message.channel.id), window)
             else:
-                await message.add_reaction('👀')
-        await bot.process_commands(message)
+                bot.outbound.submit("mention_reaction", lambda: message.add_reaction('👀'),
+                                    Priority.LOW, ("mention_reaction", message.author.id), window)
+        return True
+
+    @bot.event
+    async def on_message(message: discord.Message):
+        if await pipeline.run(bot, message):
+            await bot.process_commands(message)
 
     @bot.event
     async def on_guild_join(guild: discord.Guild):
@@ -51,6 +109,6 @@ def init_events(bot):
         embed.add_field(name='Members', value=guild.member_count, inline=True)
         embed.add_field(name='Created On', value=guild.created_at, inline=True)
         printer("SUCCESS", f"GUILD {guild.id} ADDED BOT TO THEIR SERVER")
-        await bot.app_info.owner.send(embed=embed)
+        bot.outbound.digest("guild_join", lambda: bot.app_info.owner, embed)
 
         await bot._config.register_guild_default(guild.id)
@@ -0,0 +1,112 @@
+import asyncio
+from contextvars import ContextVar
+import time
+from typing import Awaitable, Callable, Optional
+from .cache_policies import StatsLRUCache
+from .metrics import metrics
+from .records import BlacklistRecord
+from .singleflight import SingleFlight
+
+
+class GuildSettings:
+    """Every setting of a guild, resolved together and cached as one record.
+
+    Prefixes are kept as a tuple for `str.startswith`. The blacklist is the shared :BlacklistRecord: of
+    the guild, a sorted array of user IDs, so checking the author costs no further lookup.
+    """
+
+    __slots__ = ("guild_id", "prefixes", "blacklist")
+
+    def __init__(self, guild_id: int, prefixes: tuple, blacklist: BlacklistRecord) -> None:
+        self.guild_id = guild_id
+        self.prefixes = prefixes
+        self.blacklist = blacklist
+
+    def match_prefix(self, content: str) -> Optional[str]:
+        """Returns the prefix the message content starts with.
+
+        Args:
+            content (str): The content of the message.
+
+        Returns:
+            Optional[str]: The matched prefix or None if the message is not a command.
+        """
+        if not content.startswith(self.prefixes):
+            return None
+        return next(prefix for prefix in self.prefixes if content.startswith(prefix))
+
+
+# the settings of the guild the message being handled was sent in, set once per message by :GuildSettingsCache:get:
+current_settings: ContextVar[Optional[GuildSettings]] = ContextVar(
+    "current_settings", default=None)
+
+
+class GuildSettingsCache:
+    """Cache of the :GuildSettings: of each guild, so a message costs a single lookup for all of its settings.
+
+    A record is resolved from the prefix and blacklist storage on the first message of a guild.
+    It is only resolved again after :GuildSettingsCache:invalidate: is called for the guild, which happens
+    whenever one of its settings changes. A resolution in flight when the guild is invalidated may have read
+    the old settings, so its result is not cached and later messages start a new one.
+    """
+
+    def __init__(self, resolve_prefixes: Callable[[int], Awaitable[tuple]], resolve_blacklist: Callable[[int], Awaitable[BlacklistRecord]], maxsize: int) -> None:
+        self._resolve_prefixes = resolve_prefixes
+        self._resolve_blacklist = resolve_blacklist
+        self._records: StatsLRUCache = StatsLRUCache(maxsize)
+        # a guild becoming active sends many messages at once, they share one resolution
+        self._inflight = SingleFlight("settings", "guild")
+        # guild ID to the number of invalidations that raced a resolution, keys the resolutions in flight
+        self._generations: dict = {}
+
+    async def get(self, guild_id: int) -> GuildSettings:
+        """Returns the settings of the guild, resolving them on the first call.
+        They are also made the settings of the current message, see :current_settings:.
+
+        Args:
+            guild_id (int): The ID of the guild.
+
+        Returns:
+            GuildSettings: The settings of the guild.
+        """
+        started = time.perf_counter()
+        settings = self._records.get(guild_id, None)
+        if settings is None:
+            metrics.record_lookup("settings", "guild", "miss",
+                                  time.perf_counter() - started)
+            generation = self._generations.get(guild_id, 0)
+            settings = await self._inflight.do((guild_id, generation), lambda: self._resolve(guild_id, generation))
+        else:
+            metrics.record_lookup("settings", "guild", "hit",
+                                  time.perf_counter() - started)
+
+        current_settings.set(settings)
+        return settings
+
+    async def _resolve(self, guild_id: int, generation: int) -> GuildSettings:
+        prefixes, blacklist = await asyncio.gather(
+            self._resolve_prefixes(guild_id), self._resolve_blacklist(guild_id))
+        settings = GuildSettings(guild_id, tuple(prefixes), blacklist)
+        if self._generations.get(guild_id, 0) == generation:
+            self._records[guild_id] = settings
+        return settings
+
+    def resize(self, maxsize: int) -> None:
+        """Changes the number of cached records, keeping the most recently used ones.
+
+        Args:
+            maxsize (int): The new maximum number of records.
+        """
+        self._records.resize(maxsize)
+
+    def invalidate(self, guild_id) -> None:
+        """Forgets the settings of the guild so they are resolved again on the next message.
+
+        Args:
+            guild_id (Union[int, str]): The ID of the guild whose settings changed.
+        """
+        guild_id = int(guild_id)
+        self._records.pop(guild_id, None)
+        generation = self._generations.get(guild_id, 0)
+        if (guild_id, generation) in self._inflight:
+            self._generations[guild_id] = generation + 1
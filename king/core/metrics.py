@@ -0,0 +1,207 @@
+import bisect
+from pathlib import Path
+from typing import Callable, Iterable
+from .persistence import atomic_write
+
+
+class Histogram:
+    """Latency histogram with fixed buckets, in seconds."""
+
+    buckets = (0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005,
+               0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self) -> None:
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        """Estimates a quantile as the upper bound of the bucket it falls in.
+
+        Args:
+            q (float): The quantile, between 0 and 1.
+
+        Returns:
+            float: The estimated value in seconds, infinite if it is above the last bucket.
+        """
+        target, seen = q * self.count, 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= target:
+                return bound
+        return float("inf")
+
+
+class Metrics:
+    """Registry of counters and latency histograms, keyed by name and label values.
+
+    Recording is a dictionary lookup and an integer increment, cheap enough to leave on in production.
+    Gauges are not stored, they are read from the registered collectors when the metrics are rendered.
+    """
+
+    def __init__(self) -> None:
+        self.counters: dict = {}
+        self.histograms: dict = {}
+        self._collectors: list = []
+
+    def inc(self, name: str, labels: tuple = (), amount: int = 1) -> None:
+        """Increments a counter.
+
+        Args:
+            name (str): The name of the counter.
+            labels (tuple, optional): The `(label, value)` pairs of the counter. Defaults to ().
+            amount (int, optional): How much to add. Defaults to 1.
+        """
+        key = (name, labels)
+        self.counters[key] = self.counters.get(key, 0) + amount
+
+    def observe(self, name: str, labels: tuple, value: float) -> None:
+        """Records a value, usually a duration in seconds, in a histogram.
+
+        Args:
+            name (str): The name of the histogram.
+            labels (tuple): The `(label, value)` pairs of the histogram.
+            value (float): The value to record.
+        """
+        key = (name, labels)
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = Histogram()
+        histogram.observe(value)
+
+    def record_lookup(self, layer: str, collection: str, result: str, elapsed: float) -> None:
+        """Records a lookup of the storage stack.
+
+        Args:
+            layer (str): The layer that answered, e.g. `cache`, `snapshot` or `mongo`.
+            collection (str): The collection looked up, e.g. `prefix` or `blacklist`.
+            result (str): Either `hit` or `miss`.
+            elapsed (float): How long the layer took, in seconds.
+        """
+        self.inc("king_storage_lookups_total",
+                 (("layer", layer), ("collection", collection), ("result", result)))
+        self.observe("king_storage_lookup_seconds",
+                     (("layer", layer), ("collection", collection)), elapsed)
+
+    def record_stage(self, stage: str, passed: bool, elapsed: float) -> None:
+        """Records a message going through a stage of the message pipeline.
+
+        Args:
+            stage (str): The name of the stage.
+            passed (bool): Whether the message went on or was dropped.
+            elapsed (float): How long the stage took, in seconds.
+        """
+        self.inc("king_message_stage_total",
+                 (("stage", stage), ("result", "pass" if passed else "drop")))
+        self.observe("king_message_stage_seconds", (("stage", stage),), elapsed)
+
+    def add_collector(self, collector: Callable[[], Iterable[tuple]]) -> None:
+        """Registers a function returning `(name, labels, value)` gauges, called when rendering.
+
+        Args:
+            collector (Callable[[], Iterable[tuple]]): The function returning the gauges.
+        """
+        self._collectors.append(collector)
+
+    def gauges(self) -> list:
+        return [gauge for collector in self._collectors for gauge in collector()]
+
+    @staticmethod
+    def _labels(labels: tuple, extra: tuple = ()) -> str:
+        pairs = labels + extra
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{label}="{value}"' for label, value in pairs) + "}"
+
+    def render_prometheus(self) -> str:
+        """Renders every metric in the Prometheus text exposition format.
+
+        Returns:
+            str: The rendered metrics.
+        """
+        lines = []
+        typed = set()
+
+        def declare(name: str, kind: str) -> None:
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} {kind}")
+
+        for (name, labels), value in sorted(self.counters.items()):
+            declare(name, "counter")
+            lines.append(f"{name}{self._labels(labels)} {value}")
+
+        for (name, labels), histogram in sorted(self.histograms.items()):
+            declare(name, "histogram")
+            cumulative = 0
+            for bound, count in zip(histogram.buckets, histogram.counts):
+                cumulative += count
+                lines.append(
+                    f"{name}_bucket{self._labels(labels, (('le', bound),))} {cumulative}")
+            lines.append(
+                f"{name}_bucket{self._labels(labels, (('le', '+Inf'),))} {histogram.count}")
+            lines.append(f"{name}_sum{self._labels(labels)} {histogram.sum}")
+            lines.append(
+                f"{name}_count{self._labels(labels)} {histogram.count}")
+
+        for name, labels, value in sorted(self.gauges()):
+            declare(name, "gauge")
+            lines.append(f"{name}{self._labels(labels)} {value}")
+
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path: Path) -> None:
+        """Atomically writes the rendered metrics to a file, e.g. for the node exporter textfile collector.
+
+        Args:
+            path (Path): The file to write.
+        """
+        atomic_write(path, self.render_prometheus())
+
+    def lookup_summary(self) -> list:
+        """Summarizes the storage lookups per layer and collection.
+
+        Returns:
+            list: `(layer, collection, hits, misses, p50, p99)` rows, latencies in seconds.
+        """
+        rows = []
+        for (name, labels), histogram in sorted(self.histograms.items()):
+            if name != "king_storage_lookup_seconds":
+                continue
+            hits = self.counters.get(
+                ("king_storage_lookups_total", labels + (("result", "hit"),)), 0)
+            misses = self.counters.get(
+                ("king_storage_lookups_total", labels + (("result", "miss"),)), 0)
+            layer, collection = dict(labels)["layer"], dict(labels)["collection"]
+            rows.append((layer, collection, hits, misses,
+                         histogram.quantile(0.5), histogram.quantile(0.99)))
+        return rows
+
+    def stage_summary(self) -> list:
+        """Summarizes the message pipeline per stage.
+
+        Returns:
+            list: `(stage, passed, dropped, p50, p99)` rows, latencies in seconds.
+        """
+        rows = []
+        for (name, labels), histogram in sorted(self.histograms.items()):
+            if name != "king_message_stage_seconds":
+                continue
+            passed = self.counters.get(
+                ("king_message_stage_total", labels + (("result", "pass"),)), 0)
+            dropped = self.counters.get(
+                ("king_message_stage_total", labels + (("result", "drop"),)), 0)
+            rows.append((dict(labels)["stage"], passed, dropped,
+                         histogram.quantile(0.5), histogram.quantile(0.99)))
+        return rows
+
+
+# process wide registry, like the loggers of the logging module
+metrics = Metrics()
@@ -0,0 +1,232 @@
+import asyncio
+from collections import deque
+from enum import IntEnum
+import time
+from typing import Awaitable, Callable, Hashable, Optional
+import discord
+from .metrics import metrics
+from .ratelimit import TokenBuckets
+from .utils.color import printer
+
+
+class Priority(IntEnum):
+    """The order in which queued calls are sent, lower first."""
+    HIGH = 0
+    NORMAL = 1
+    LOW = 2
+
+
+def digest_embed(embeds: list) -> discord.Embed:
+    """Merges notifications of the same kind into a single embed, one field each.
+
+    The first field of each notification names its digest field, the others make up its value.
+
+    Args:
+        embeds (list): The embeds of the notifications.
+
+    Returns:
+        discord.Embed: The digest, or the only embed if there is just one.
+    """
+    if len(embeds) == 1:
+        return embeds[0]
+
+    first = embeds[0]
+    digest = discord.Embed(
+        title=f"{first.title} ({len(embeds)})", type='rich', color=first.color)
+    # keeps the digest below the 6000 characters Discord allows per embed
+    for embed in embeds[:20]:
+        if embed.fields:
+            name = str(embed.fields[0].value)
+            value = " | ".join(
+                f"{field.name}: {field.value}" for field in embed.fields[1:]) or "\u200b"
+        else:
+            name, value = str(embed.title), str(embed.description)
+        digest.add_field(name=name[:256], value=value[:250], inline=False)
+    if len(embeds) > 20:
+        digest.set_footer(text=f"and {len(embeds) - 20} more")
+    return digest
+
+
+class OutboundQueue:
+    """Sends the REST calls the bot makes on its own, e.g. notices and notifications, within a budget.
+
+    Calls are queued by priority and sent at up to `rate` calls per second, so bursts of them during
+    raids or mass invites do not use up the rate limits needed by command responses. A call may carry
+    a dedupe key, further calls with the same key are dropped until its window has passed. When the
+    queue is full, the newest call of a lower priority makes room, or else the new call is dropped.
+    Notifications sent through :OutboundQueue:digest: are gathered over `digest_interval` and sent as
+    a single embed.
+
+    Args:
+        rate (float): Calls per second, 0 disables the budget.
+        burst (float): How many calls can be sent at once after a quiet period.
+        maxsize (int, optional): How many calls can wait in the queue. Defaults to 500.
+        digest_interval (float, optional): Seconds notifications are gathered for, 0 sends them right away. Defaults to 60.
+    """
+
+    def __init__(self, rate: float, burst: float, maxsize: int = 500, digest_interval: float = 60) -> None:
+        self._budget: Optional[TokenBuckets] = TokenBuckets(
+            rate, burst) if rate else None
+        self.maxsize = maxsize
+        self.digest_interval = digest_interval
+        self._queues: dict = {priority: deque() for priority in Priority}
+        self._size = 0
+        self._wakeup: Optional[asyncio.Event] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._sending: set = set()
+        # dedupe key to the monotonic time its window ends
+        self._recent: dict = {}
+        self._swept_at = time.monotonic()
+        # digest kind to its destination, priority, gathered embeds and the handle of its flush
+        self._digests: dict = {}
+
+    def __len__(self) -> int:
+        return self._size
+
+    def submit(self, kind: str, call: Callable[[], Awaitable], priority: Priority = Priority.NORMAL, dedupe_key: Hashable = None, window: float = 0) -> bool:
+        """Queues a call.
+
+        Args:
+            kind (str): What the call is for, used by the metrics.
+            call (Callable[[], Awaitable]): Makes the call, e.g. `lambda: user.send(...)`.
+            priority (Priority, optional): Defaults to Priority.NORMAL.
+            dedupe_key (Hashable, optional): Identifies calls with the same effect, e.g. `("dm_notice", user.id)`. Defaults to None.
+            window (float, optional): Seconds further calls with the same dedupe key are dropped for. Defaults to 0.
+
+        Returns:
+            bool: Whether or not the call was queued.
+        """
+        now = time.monotonic()
+        if now - self._swept_at >= 60:
+            self.sweep(now)
+
+        if dedupe_key is not None and self._recent.get(dedupe_key, 0) > now:
+            metrics.inc("king_outbound_calls_total",
+                        (("kind", kind), ("result", "deduped")))
+            return False
+
+        if self._size >= self.maxsize:
+            victim = next((queue for level, queue in sorted(self._queues.items(), reverse=True)
+                           if queue and level > priority), None)
+            if victim is None:
+                metrics.inc("king_outbound_calls_total",
+                            (("kind", kind), ("result", "dropped")))
+                return False
+            dropped, _ = victim.pop()
+            self._size -= 1
+            metrics.inc("king_outbound_calls_total",
+                        (("kind", dropped), ("result", "dropped")))
+
+        self._queues[priority].append((kind, call))
+        self._size += 1
+        # only a queued call starts the window, a dropped one leaves the next attempt free to go out
+        if dedupe_key is not None and window:
+            self._recent[dedupe_key] = now + window
+        self._ensure_worker()
+        self._wakeup.set()
+        return True
+
+    def digest(self, kind: str, destination: Callable[[], discord.abc.Messageable], embed: discord.Embed, priority: Priority = Priority.NORMAL) -> None:
+        """Gathers a notification, sent with the others of its kind as a single embed, see :digest_embed:.
+
+        Args:
+            kind (str): What the notifications are about, e.g. `guild_join`.
+            destination (Callable[[], discord.abc.Messageable]): Returns where to send the digest, called when it is sent.
+            embed (discord.Embed): The notification.
+            priority (Priority, optional): Defaults to Priority.NORMAL.
+        """
+        if not self.digest_interval:
+            self.submit(kind, lambda: destination().send(embed=embed), priority)
+            return
+
+        pending = self._digests.get(kind)
+        if pending is None:
+            handle = asyncio.get_event_loop().call_later(
+                self.digest_interval, self._flush_digest, kind)
+            pending = self._digests[kind] = (destination, priority, [], handle)
+        pending[2].append(embed)
+
+    @staticmethod
+    def _digest_call(destination: Callable[[], discord.abc.Messageable], embeds: list) -> Callable[[], Awaitable]:
+        digest = digest_embed(embeds)
+        return lambda: destination().send(embed=digest)
+
+    def _flush_digest(self, kind: str) -> None:
+        destination, priority, embeds, _ = self._digests.pop(kind)
+        self.submit(kind, self._digest_call(destination, embeds), priority)
+
+    def sweep(self, now: Optional[float] = None) -> int:
+        """Drops the dedupe keys whose window has passed, and the refilled budget.
+
+        Args:
+            now (Optional[float], optional): The current monotonic time. Defaults to None.
+
+        Returns:
+            int: The number of dropped dedupe keys.
+        """
+        now = time.monotonic() if now is None else now
+        self._swept_at = now
+        expired = [key for key, until in self._recent.items() if until <= now]
+        for key in expired:
+            del self._recent[key]
+        if self._budget is not None:
+            self._budget.sweep(now)
+        return len(expired)
+
+    def _ensure_worker(self) -> None:
+        if self._worker is None or self._worker.done():
+            self._wakeup = self._wakeup or asyncio.Event()
+            self._worker = asyncio.get_event_loop().create_task(self._run())
+
+    def _pop(self) -> tuple:
+        for queue in self._queues.values():
+            if queue:
+                self._size -= 1
+                return queue.popleft()
+
+    async def _run(self) -> None:
+        while True:
+            if not self._size:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            if self._budget is not None:
+                while not self._budget.consume(0, time.monotonic()):
+                    await asyncio.sleep(1 / self._budget.rate)
+            kind, call = self._pop()
+            # sent concurrently, the budget bounds how many are in flight rather than the latency of each
+            task = asyncio.ensure_future(self._send(kind, call))
+            self._sending.add(task)
+            task.add_done_callback(self._sending.discard)
+
+    async def _send(self, kind: str, call: Callable[[], Awaitable]) -> None:
+        try:
+            await call()
+        except discord.HTTPException as e:
+            printer("ERROR", f"FAILED TO SEND {kind.upper()}: {e}")
+            metrics.inc("king_outbound_calls_total",
+                        (("kind", kind), ("result", "failed")))
+        else:
+            metrics.inc("king_outbound_calls_total",
+                        (("kind", kind), ("result", "sent")))
+
+    async def close(self) -> None:
+        """Stops sending, waiting for the calls in flight. Pending digests are sent right away, outside of
+        the budget, queued calls are dropped."""
+        if self._worker is not None:
+            self._worker.cancel()
+        if self._digests:
+            printer("INFO", f"SENDING {len(self._digests)} PENDING DIGESTS")
+        for kind in list(self._digests):
+            destination, _, embeds, handle = self._digests.pop(kind)
+            handle.cancel()
+            task = asyncio.ensure_future(
+                self._send(kind, self._digest_call(destination, embeds)))
+            self._sending.add(task)
+            task.add_done_callback(self._sending.discard)
+        if self._sending:
+            await asyncio.gather(*self._sending, return_exceptions=True)
+
+    @property
+    def stats(self) -> dict:
+        return {priority.name.lower(): len(queue) for priority, queue in self._queues.items()}
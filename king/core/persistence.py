@@ -0,0 +1,187 @@
+import asyncio
+from datetime import datetime
+import os
+from pathlib import Path
+import tempfile
+from typing import Optional, Union
+from .utils.color import printer
+
+
+def atomic_write(path: Path, text: Union[str, bytes]) -> None:
+    """Writes the text to a temporary file next to the given path and renames it over the path.
+
+    Readers either see the previous file or the complete new one, never a partial write.
+
+    Args:
+        path (Path): The file to replace.
+        text (Union[str, bytes]): The full contents of the new file.
+    """
+    path = Path(path)
+    fd, tmp = tempfile.mkstemp(prefix=f".{path.name}.", dir=path.parent)
+    try:
+        with os.fdopen(fd, "wb" if isinstance(text, bytes) else "w") as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+class SnapshotWriter:
+    """Keeps the local storage of a :Manager: in sync without blocking the event loop.
+
+    Writes are recorded as dirty keys and coalesced for `interval` seconds. The merged snapshot is then
+    serialized in a worker thread and written atomically. Reads of keys that are still pending are
+    answered from memory so they never see stale data.
+    """
+
+    def __init__(self, path: Path, snapshot_format, interval: float = 1.0) -> None:
+        self.path = Path(path)
+        self.format = snapshot_format
+        self.interval = interval
+        self._dirty: dict = {}
+        self._replace: Optional[dict] = None
+        self._flushing: tuple = (None, {})
+        self._handle: Optional[asyncio.TimerHandle] = None
+        self._lock: Optional[asyncio.Lock] = None
+
+    def load(self) -> dict:
+        """Reads the whole snapshot from disk. Blocking, only meant to be used before the bot starts.
+
+        Returns:
+            dict: Every stored entry keyed by guild id.
+        """
+        return self.format.load(self.path)
+
+    @property
+    def pending(self) -> int:
+        """The number of keys waiting to be written."""
+        return len(self._dirty) + len(self._replace or {})
+
+    async def get(self, key: str) -> Optional[dict]:
+        """Returns the stored value of a single key, checking pending writes before the file.
+
+        Args:
+            key (str): The key to look up.
+
+        Returns:
+            Optional[dict]: The stored value or None if the key does not exist.
+        """
+        for replace, dirty in ((self._replace, self._dirty), self._flushing):
+            if key in dirty:
+                return dirty[key]
+            if replace is not None:
+                return replace.get(key, None)
+
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(None, self.format.get, self.path, key)
+
+    async def keys(self) -> set:
+        """Returns every stored key, including the ones still waiting to be written.
+        The file itself is read in a worker thread.
+
+        Returns:
+            set: The stored keys.
+        """
+        loop = asyncio.get_event_loop()
+        keys = set(await loop.run_in_executor(None, self.load))
+        # oldest first, a pending replace drops every key it does not have
+        for replace, dirty in (self._flushing, (self._replace, self._dirty)):
+            if replace is not None:
+                keys = set(replace)
+            keys.update(dirty)
+        return keys
+
+    def mark_dirty(self, key: str, value: dict) -> None:
+        """Records a changed key to be written with the next flush.
+
+        Args:
+            key (str): The key that changed.
+            value (dict): The new value of the key.
+        """
+        self._dirty[key] = value
+        self._schedule()
+
+    def replace(self, new_storage: dict) -> None:
+        """Completely replaces the stored snapshot with the next flush.
+
+        Args:
+            new_storage (dict): The new contents of the snapshot.
+        """
+        self._replace = dict(new_storage)
+        self._dirty = {}
+        self._schedule()
+
+    def _schedule(self) -> None:
+        if self._handle is None:
+            loop = asyncio.get_event_loop()
+            self._handle = loop.call_later(self.interval, self._flush_soon)
+
+    def _flush_soon(self) -> None:
+        self._handle = None
+        asyncio.ensure_future(self.flush())
+
+    def _write(self, replace: Optional[dict], dirty: dict) -> None:
+        storage = replace if replace is not None else self.load()
+        storage.update(dirty)
+        self.format.dump(self.path, storage)
+
+    async def flush(self) -> None:
+        """Writes every pending change to disk in a worker thread."""
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+
+        async with self._lock:
+            replace, dirty = self._replace, self._dirty
+            if replace is None and not dirty:
+                return
+
+            self._replace, self._dirty = None, {}
+            self._flushing = (replace, dirty)
+            loop = asyncio.get_event_loop()
+            try:
+                await loop.run_in_executor(None, self._write, replace, dirty)
+            except OSError as e:
+                printer("ERROR", f"FAILED TO WRITE {self.path}: {e}")
+                # keep the failed changes unless they were overwritten meanwhile
+                if self._replace is None:
+                    self._replace = replace
+                    self._dirty = {**dirty, **self._dirty}
+                self._schedule()
+            finally:
+                self._flushing = (None, {})
+
+
+class SyncWatermark:
+    """The `updated_at` of the newest database document already merged into a local snapshot.
+
+    It is stored in a file next to the snapshot so the next startup only pulls newer documents.
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = Path(path)
+
+    def load(self) -> Optional[datetime]:
+        """Reads the stored watermark.
+
+        Returns:
+            Optional[datetime]: The watermark or None if the snapshot was never synced.
+        """
+        try:
+            return datetime.fromisoformat(self.path.read_text().strip())
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def save(self, watermark: datetime) -> None:
+        """Stores the watermark, only to be called once the snapshot containing it is written.
+
+        Args:
+            watermark (datetime): The `updated_at` of the newest synced document.
+        """
+        atomic_write(self.path, watermark.isoformat())
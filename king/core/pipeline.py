@@ -0,0 +1,119 @@
+import time
+from typing import Awaitable, Callable, Optional
+from .guild_settings import GuildSettings
+from .metrics import metrics
+
+
+class MessageState:
+    """What the stages of a :MessagePipeline: know about the message, computed once on first use."""
+
+    __slots__ = ("bot", "message", "_mentioned", "_settings")
+
+    def __init__(self, bot, message) -> None:
+        self.bot = bot
+        self.message = message
+        self._mentioned: Optional[bool] = None
+        self._settings: Optional[GuildSettings] = None
+
+    @property
+    def mentioned(self) -> bool:
+        """Whether the bot itself was mentioned, `@everyone` does not count."""
+        if self._mentioned is None:
+            self._mentioned = self.bot.user.mentioned_in(
+                self.message) and self.message.mention_everyone is False
+        return self._mentioned
+
+    async def settings(self) -> Optional[GuildSettings]:
+        """Returns the settings of the guild of the message, see :GuildSettingsCache:get:.
+
+        Returns:
+            Optional[GuildSettings]: The settings, None if the message was not sent in a guild.
+        """
+        if self._settings is None and self.message.guild:
+            self._settings = await self.bot.guild_settings.get(self.message.guild.id)
+        return self._settings
+
+
+class MessageStage:
+    """A step of the :MessagePipeline:.
+
+    Args:
+        name (str): The name of the stage, used by the metrics and the `message_stage_costs` option.
+        check (Callable[[MessageState], Awaitable[bool]]): Returns whether the message may go on.
+        cost (int): How expensive the stage is, cheaper stages run first.
+        short_circuit (bool): Whether the stage can drop messages. Stages that cannot, e.g. reactions, always let them go on.
+    """
+
+    __slots__ = ("name", "check", "cost", "short_circuit")
+
+    def __init__(self, name: str, check: Callable[[MessageState], Awaitable[bool]], cost: int, short_circuit: bool) -> None:
+        self.name = name
+        self.check = check
+        self.cost = cost
+        self.short_circuit = short_circuit
+
+
+class MessagePipeline:
+    """The stages every message goes through before its command is processed, cheapest first.
+
+    Stages are registered by `init_events` and can be added or removed by cogs. Each run records,
+    per stage, how many messages passed or were dropped and how long the stage took.
+    """
+
+    def __init__(self, costs: Optional[dict] = None) -> None:
+        self._costs: dict = costs or {}
+        self._stages: list = []
+
+    @property
+    def stages(self) -> list:
+        return list(self._stages)
+
+    def add(self, name: str, check: Callable[[MessageState], Awaitable[bool]], cost: int, short_circuit: bool = True) -> None:
+        """Registers a stage, replacing any stage with the same name.
+
+        Args:
+            name (str): The name of the stage.
+            check (Callable[[MessageState], Awaitable[bool]]): Returns whether the message may go on.
+            cost (int): How expensive the stage is, overridden by the `message_stage_costs` option.
+            short_circuit (bool, optional): Whether the stage can drop messages. Defaults to True.
+        """
+        self.remove(name)
+        self._stages.append(MessageStage(
+            name, check, self._costs.get(name, cost), short_circuit))
+        # stable, so stages of equal cost keep their registration order
+        self._stages.sort(key=lambda stage: stage.cost)
+
+    def stage(self, name: str, cost: int, short_circuit: bool = True):
+        """Decorator registering the decorated coroutine as a stage, see :MessagePipeline:add:."""
+        def decorator(check):
+            self.add(name, check, cost, short_circuit)
+            return check
+        return decorator
+
+    def remove(self, name: str) -> None:
+        """Unregisters a stage, e.g. when the cog that added it is unloaded.
+
+        Args:
+            name (str): The name of the stage.
+        """
+        self._stages = [stage for stage in self._stages if stage.name != name]
+
+    async def run(self, bot, message) -> bool:
+        """Runs the message through every stage until one drops it.
+
+        Args:
+            bot (KingBot): The bot which received the message.
+            message (discord.Message): The message.
+
+        Returns:
+            bool: Whether or not the message went through every stage.
+        """
+        state = MessageState(bot, message)
+        for stage in self._stages:
+            started = time.perf_counter()
+            passed = await stage.check(state) or not stage.short_circuit
+            metrics.record_stage(stage.name, passed,
+                                 time.perf_counter() - started)
+            if not passed:
+                return False
+        return True
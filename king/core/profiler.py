@@ -0,0 +1,119 @@
+import cProfile
+from contextlib import contextmanager
+import json
+from pathlib import Path
+import time
+import tracemalloc
+from typing import Optional
+from .persistence import atomic_write
+
+
+class StartupProfiler:
+    """Records the wall time and net allocations of each startup phase.
+
+    Disabled until :StartupProfiler:enable: is called, a phase then costs two clock reads. Phases may be
+    nested or span several callbacks with :StartupProfiler:begin: and :StartupProfiler:end:, e.g. the
+    gateway login which ends in `on_ready`. Allocations are only traced with `trace_allocations`,
+    since tracemalloc slows everything down.
+    """
+
+    def __init__(self) -> None:
+        self.enabled = False
+        self.phases: list = []
+        self._open: dict = {}
+        self._started = 0.0
+        self._cprofile: Optional[cProfile.Profile] = None
+
+    def enable(self, trace_allocations: bool = True, cprofile: bool = False) -> None:
+        """Starts recording phases.
+
+        Args:
+            trace_allocations (bool, optional): Whether to trace the allocations of each phase. Defaults to True.
+            cprofile (bool, optional): Whether to also run cProfile until :StartupProfiler:finish:. Defaults to False.
+        """
+        self.enabled = True
+        self._started = time.perf_counter()
+        if trace_allocations:
+            tracemalloc.start()
+        if cprofile:
+            self._cprofile = cProfile.Profile()
+            self._cprofile.enable()
+
+    def _allocated(self) -> int:
+        return tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else 0
+
+    def begin(self, name: str) -> None:
+        """Starts a phase, ended by :StartupProfiler:end: with the same name.
+
+        Args:
+            name (str): The name of the phase.
+        """
+        if not self.enabled:
+            return
+        self._open[name] = (len(self._open), time.perf_counter(), self._allocated())
+
+    def end(self, name: str) -> None:
+        """Ends a phase started by :StartupProfiler:begin:, ignored if it was not started.
+
+        Args:
+            name (str): The name of the phase.
+        """
+        if name not in self._open:
+            return
+        depth, started, allocated = self._open.pop(name)
+        self.phases.append({
+            "name": name,
+            "depth": depth,
+            "started_at": round(started - self._started, 6),
+            "seconds": round(time.perf_counter() - started, 6),
+            "allocated_bytes": self._allocated() - allocated,
+        })
+
+    @contextmanager
+    def phase(self, name: str):
+        """Records the code run within the `with` block as a phase.
+
+        Args:
+            name (str): The name of the phase.
+        """
+        self.begin(name)
+        try:
+            yield
+        finally:
+            self.end(name)
+
+    def finish(self, cprofile_path: Optional[Path] = None) -> dict:
+        """Stops recording and returns the report.
+
+        Args:
+            cprofile_path (Optional[Path], optional): Where to dump the cProfile stats, if cProfile ran. Defaults to None.
+
+        Returns:
+            dict: The total time, the peak of traced memory and every phase in the order they started.
+        """
+        report = {
+            "total_seconds": round(time.perf_counter() - self._started, 6),
+            "peak_allocated_bytes": tracemalloc.get_traced_memory()[1] if tracemalloc.is_tracing() else 0,
+            "phases": sorted(self.phases, key=lambda phase: phase["started_at"]),
+            "unfinished": list(self._open),
+        }
+        if self._cprofile is not None:
+            self._cprofile.disable()
+            if cprofile_path is not None:
+                self._cprofile.dump_stats(str(cprofile_path))
+        tracemalloc.stop()
+        self.enabled = False
+        return report
+
+    def write(self, path: Path, report: dict) -> None:
+        """Writes the report as JSON.
+
+        Args:
+            path (Path): The file to write.
+            report (dict): The report returned by :StartupProfiler:finish:.
+        """
+        atomic_write(path, json.dumps(report, indent=2))
+
+
+# process wide, so every module can record its phases without passing it around
+profiler = StartupProfiler()
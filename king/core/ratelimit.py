@@ -0,0 +1,135 @@
+import time
+from typing import Optional
+from .metrics import metrics
+
+
+class TokenBuckets:
+    """Token buckets keyed by ID, each stored as a `(tokens, updated_at)` tuple in a single dict.
+
+    A bucket holds up to `burst` tokens and refills at `rate` tokens per second, every allowed message
+    takes one. Buckets that have refilled completely are the same as missing ones, so :TokenBuckets:sweep:
+    drops them to keep the table as small as the set of recently active IDs.
+    """
+
+    __slots__ = ("rate", "burst", "_buckets")
+
+    def __init__(self, rate: float, burst: float) -> None:
+        self.rate = rate
+        self.burst = burst
+        self._buckets: dict = {}
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    def tokens(self, key: int, now: float) -> float:
+        """Returns how many tokens the bucket of the key holds, without taking any.
+
+        Args:
+            key (int): The ID owning the bucket.
+            now (float): The current monotonic time.
+
+        Returns:
+            float: The available tokens.
+        """
+        tokens, updated_at = self._buckets.get(key, (self.burst, now))
+        return min(self.burst, tokens + (now - updated_at) * self.rate)
+
+    def consume(self, key: int, now: float) -> bool:
+        """Takes a token from the bucket of the key.
+
+        Args:
+            key (int): The ID owning the bucket.
+            now (float): The current monotonic time.
+
+        Returns:
+            bool: Whether or not a token was available.
+        """
+        tokens, updated_at = self._buckets.get(key, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - updated_at) * self.rate)
+        if tokens < 1:
+            self._buckets[key] = (tokens, now)
+            return False
+        self._buckets[key] = (tokens - 1, now)
+        return True
+
+    def sweep(self, now: float) -> int:
+        """Drops the buckets that have refilled completely.
+
+        Args:
+            now (float): The current monotonic time.
+
+        Returns:
+            int: The number of dropped buckets.
+        """
+        full = [key for key, (tokens, updated_at) in self._buckets.items()
+                if tokens + (now - updated_at) * self.rate >= self.burst]
+        for key in full:
+            del self._buckets[key]
+        return len(full)
+
+
+class RateLimiter:
+    """Drops messages of users and guilds sending more than their configured rate, before any other work.
+
+    A message needs a token from the bucket of its author and from the bucket of its guild, so a
+    spamming user is throttled before they can use up the budget of their guild, and a raided guild
+    cannot slow the bot down for the others. Tokens are only taken when both buckets have one, a
+    message dropped by one limit does not count against the other. A rate of 0 disables the
+    corresponding limit.
+    """
+
+    def __init__(self, user_rate: float, user_burst: float, guild_rate: float, guild_burst: float, sweep_interval: float = 60) -> None:
+        self.users: Optional[TokenBuckets] = TokenBuckets(
+            user_rate, user_burst) if user_rate else None
+        self.guilds: Optional[TokenBuckets] = TokenBuckets(
+            guild_rate, guild_burst) if guild_rate else None
+        self.sweep_interval = sweep_interval
+        self._swept_at = time.monotonic()
+
+    def allow(self, guild_id: Optional[int], user_id: int) -> bool:
+        """Checks whether a message may be handled, taking a token from the buckets of its author and guild.
+
+        Args:
+            guild_id (Optional[int]): The ID of the guild of the message, None for direct messages.
+            user_id (int): The ID of the author of the message.
+
+        Returns:
+            bool: Whether or not the message may be handled.
+        """
+        now = time.monotonic()
+        if now - self._swept_at >= self.sweep_interval:
+            self.sweep(now)
+
+        guilds = self.guilds if guild_id is not None else None
+        if self.users is not None and self.users.tokens(user_id, now) < 1:
+            metrics.inc("king_ratelimited_messages_total", (("scope", "user"),))
+            return False
+        if guilds is not None and guilds.tokens(guild_id, now) < 1:
+            metrics.inc("king_ratelimited_messages_total", (("scope", "guild"),))
+            return False
+
+        if self.users is not None:
+            self.users.consume(user_id, now)
+        if guilds is not None:
+            guilds.consume(guild_id, now)
+        return True
+
+    def sweep(self, now: Optional[float] = None) -> int:
+        """Drops the buckets of users and guilds that have not been limited recently.
+
+        Args:
+            now (Optional[float], optional): The current monotonic time. Defaults to None.
+
+        Returns:
+            int: The number of dropped buckets.
+        """
+        now = time.monotonic() if now is None else now
+        self._swept_at = now
+        return sum(buckets.sweep(now) for buckets in (self.users, self.guilds) if buckets is not None)
+
+    @property
+    def stats(self) -> dict:
+        return {
+            "users": len(self.users) if self.users is not None else 0,
+            "guilds": len(self.guilds) if self.guilds is not None else 0,
+        }
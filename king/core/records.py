@@ -0,0 +1,84 @@
+from array import array
+from bisect import bisect_left
+import sys
+from typing import Iterable
+from weakref import WeakValueDictionary
+
+
+class PrefixRecord:
+    """The cached prefixes of a guild.
+
+    Records are immutable and shared, every guild using the same prefixes holds the same record, whose
+    prefix strings are interned. Most guilds keep the default prefix, so they all cost a single record.
+    """
+
+    __slots__ = ("prefixes", "__weakref__")
+
+    _shared: "WeakValueDictionary[tuple, PrefixRecord]" = WeakValueDictionary()
+
+    def __init__(self, prefixes: tuple) -> None:
+        self.prefixes = prefixes
+
+    @classmethod
+    def from_entry(cls, entry: dict) -> "PrefixRecord":
+        """Returns the record of a stored entry such as `{"prefixes": ["!"]}`.
+
+        Args:
+            entry (dict): The stored entry.
+
+        Returns:
+            PrefixRecord: The shared record holding the same prefixes.
+        """
+        prefixes = tuple(sys.intern(str(prefix))
+                         for prefix in entry.get("prefixes") or ())
+        record = cls._shared.get(prefixes)
+        if record is None:
+            record = cls._shared[prefixes] = cls(prefixes)
+        return record
+
+    def sizeof(self) -> int:
+        """The bytes held by the record, its interned strings are shared and not counted."""
+        return sys.getsizeof(self) + sys.getsizeof(self.prefixes)
+
+
+class BlacklistRecord:
+    """The cached blacklist of a guild, as a sorted array of user IDs.
+
+    Membership is a binary search over 8 bytes per user. The reasons are only needed when the
+    blacklist is rewritten, so they are left in the local storage rather than kept in memory.
+    """
+
+    __slots__ = ("users",)
+
+    def __init__(self, users: Iterable[int]) -> None:
+        self.users = array("q", sorted(users))
+
+    @classmethod
+    def from_entry(cls, entry: dict) -> "BlacklistRecord":
+        """Returns the record of a stored entry such as `{"blacklist": {"<user_id>": {"reason": ...}}}`.
+
+        Args:
+            entry (dict): The stored entry.
+
+        Returns:
+            BlacklistRecord: The new record.
+        """
+        users = entry.get("blacklist") or {}
+        if not users:
+            return EMPTY_BLACKLIST
+        return cls(int(user_id) for user_id in users)
+
+    def __contains__(self, user_id: int) -> bool:
+        i = bisect_left(self.users, user_id)
+        return i < len(self.users) and self.users[i] == user_id
+
+    def __len__(self) -> int:
+        return len(self.users)
+
+    def sizeof(self) -> int:
+        """The bytes held by the record."""
+        return sys.getsizeof(self) + sys.getsizeof(self.users)
+
+
+# shared by every guild without blacklisted users
+EMPTY_BLACKLIST = BlacklistRecord(())
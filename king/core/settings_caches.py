@@ -1,9 +1,12 @@
 from pathlib import Path
 from .base import Manager
+from .errors import CacheNotFoundError
+from .records import EMPTY_BLACKLIST, BlacklistRecord, PrefixRecord
 
 
 class PrefixManager(Manager):
     path_ = Path("core/data/prefixes.yaml")
+    record_type = PrefixRecord
 
     def __init__(self, config: dict) -> None:
         super().__init__(PrefixManager.path_, config)
@@ -11,6 +14,51 @@ class PrefixManager(Manager):
 
 class BlacklistManager(Manager):
     path_ = Path("core/data/blacklist.yaml")
+    record_type = BlacklistRecord
 
     def __init__(self, config: dict) -> None:
         super().__init__(BlacklistManager.path_, config)
+
+    async def record(self, guild_id: int) -> BlacklistRecord:
+        """Returns the blacklist of the guild, empty if the guild has no entry.
+
+        Args:
+            guild_id (int): The ID of the guild.
+
+        Returns:
+            BlacklistRecord: The cached record of the guild.
+        """
+        try:
+            return await self.find_one({"_id": guild_id})
+        except CacheNotFoundError:
+            return EMPTY_BLACKLIST
+
+    async def contains(self, guild_id: int, user_id: int) -> bool:
+        """Checks whether the user has an entry in the blacklist of the guild.
+
+        Args:
+            guild_id (int): The ID of the guild.
+            user_id (int): The ID of the user.
+
+        Returns:
+            bool: Whether or not the user is blacklisted.
+        """
+        return user_id in await self.record(guild_id)
+
+    async def add(self, guild_id: int, user_id: int, fields: dict) -> dict:
+        """Adds a user to the blacklist of the guild, keeping the users already in it.
+
+        Args:
+            guild_id (int): The ID of the guild.
+            user_id (int): The ID of the user.
+            fields (dict): The blacklist entry of the user, e.g. its reason.
+
+        Returns:
+            dict: The new entry of the guild.
+        """
+        stored = await self.stored_entry(guild_id) or {}
+        # cached values are shared with readers, the entry is replaced rather than changed in place
+        entry = {**stored, "blacklist": {
+            **(stored.get("blacklist") or {}), str(user_id): fields}}
+        await self.insert_one(guild_id, entry)
+        return entry
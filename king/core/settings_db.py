@@ -1,4 +1,8 @@
+import asyncio
+from typing import Iterable, Optional
 from .base import Database
+from .profiler import profiler
+from .records import BlacklistRecord
 from .settings_caches import PrefixManager, BlacklistManager
 from .utils.color import printer
 
@@ -14,35 +18,157 @@ class PrefixDatabase(Database):
         self._cache_manager = PrefixManager(self._config)
 
         printer("INFO", "SYNCING PREFIX DATABASE AND CACHE")
-        self._cache_manager.cache = self.find()
-
-    async def _find(self) -> dict:
-        ret = self._collection.find({})
-        ret = await ret.to_list(length=None)
-        ret = {
-            str(c.pop("_id")): c
-            for c in ret
-        }
-        return ret
+        with profiler.phase("sync.prefixes"):
+            printer("INFO", f"PULLED {self.sync()} CHANGED PREFIX ENTRIES")
 
 
 class BlacklistDatabase(Database):
+    """Blacklist stored as one document per blacklisted user, `{guild_id, user_id, reason, updated_at}`.
+
+    The documents are unique by the compound `(guild_id, user_id)` index, whose `guild_id` prefix also
+    serves the reads of a whole guild. The local storage keeps one entry per guild,
+    `{"blacklist": {user_id: {"reason": ...}}}`, assembled from them by the sync.
+    Collections still holding one document per guild are converted by `python -m tools.migrate_blacklist`.
+    """
 
     collection_name = "blacklist"
+    key_fields = ("guild_id", "user_id")
+    index_name = "guild_id_user_id"
 
     def __init__(self, config: dict) -> None:
         super().__init__(config, BlacklistDatabase.collection_name)
 
         # still using caching in order to avoid querying the database all the time.
         self._cache_manager = BlacklistManager(self._config)
+        # the local entries while syncing, see :BlacklistDatabase:_collect:
+        self._synced: Optional[dict] = None
 
         printer("INFO", "SYNCING BLACKLIST DATABASE AND CACHE")
-        self._cache_manager.cache = self.find()
-
-    async def _find(self) -> list:
-        ret = self._collection.find({})
-        ret = await ret.to_list(length=None)
-        ret = {
-            str(c.pop("_id")): c for c in ret
-        }
-        return ret
+        with profiler.phase("sync.blacklist"):
+            printer("INFO", f"PULLED {self.sync()} CHANGED BLACKLIST ENTRIES")
+
+    @classmethod
+    async def create_index(cls, collection) -> None:
+        """Creates the unique compound `(guild_id, user_id)` index of the collection.
+
+        Only to be called once no guild documents are left, they have neither field and would all
+        collide as `(null, null)` in the index.
+
+        Args:
+            collection (AsyncIOMotorCollection): The blacklist collection.
+        """
+        await collection.create_index(
+            [("guild_id", 1), ("user_id", 1)], name=cls.index_name, unique=True)
+
+    async def _ensure_indexes(self) -> None:
+        await super()._ensure_indexes()
+        if await self._collection.find_one({"blacklist": {"$exists": True}}, {"_id": 1}):
+            # the index is created by the migration, or by the first start after it
+            printer(
+                "ERROR", "BLACKLIST COLLECTION STILL HAS ONE DOCUMENT PER GUILD, RUN python -m tools.migrate_blacklist")
+            return
+        await self.create_index(self._collection)
+
+    async def _sync(self) -> int:
+        # the local entries the pulled users are merged into, read once rather than once per guild
+        loop = asyncio.get_event_loop()
+        self._synced = await loop.run_in_executor(None, self._cache_manager.snapshot)
+        try:
+            return await super()._sync()
+        finally:
+            self._synced = None
+
+    async def _collect(self, changed: dict, doc: dict) -> None:
+        if "blacklist" in doc:
+            # not migrated yet, the document is already a guild entry
+            key = str(doc.pop("_id"))
+            users = doc["blacklist"] or {}
+        else:
+            doc.pop("_id", None)
+            key = str(doc.pop("guild_id"))
+            users = {str(doc.pop("user_id")): doc}
+
+        if key not in changed:
+            # kept in _synced too, for the users of the guild pulled with a later batch
+            changed[key] = self._synced[key] = dict(self._synced.get(key) or {})
+        changed[key]["blacklist"] = {
+            **(changed[key].get("blacklist") or {}), **users}
+
+    def _documents(self, guild_id: int, entry: dict) -> dict:
+        return {(int(guild_id), int(user_id)): fields
+                for user_id, fields in (entry.get("blacklist") or {}).items()}
+
+    async def _query(self, entry: dict) -> Optional[dict]:
+        # a prefix of the compound index, the users of the guild are assembled into its local entry
+        cursor = self._collection.find(
+            {"guild_id": int(self._cache_manager.key_of(entry))}, {"_id": 0, "guild_id": 0, "updated_at": 0})
+        users = {str(doc.pop("user_id")): doc async for doc in cursor}
+        return {"blacklist": users} if users else None
+
+    async def missing(self, keys: Iterable) -> list:
+        """Returns the guilds without any blacklisted user, with one `distinct` query per `sync_batch_size` keys.
+
+        Args:
+            keys (Iterable): The guild ids to check.
+
+        Returns:
+            list: The guild ids without a blacklisted user.
+        """
+        pending = {guild_id for guild_id, _ in self._writes.keys()}
+        keys = [key for key in keys if int(key) not in pending]
+        batch_size = self._config.get("SYNC_BATCH_SIZE", 1000)
+        stored = set()
+        for i in range(0, len(keys), batch_size):
+            stored.update(await self._collection.distinct(
+                "guild_id", {"guild_id": {"$in": [int(key) for key in keys[i:i + batch_size]]}}))
+        return [key for key in keys if int(key) not in stored]
+
+    async def record(self, guild_id: int) -> BlacklistRecord:
+        """Returns the blacklist of the guild, see :BlacklistManager:record:.
+
+        The local storage holds every synced guild and the bans made since, through this process or
+        the cache bus, so a guild it does not have, or the negative cache remembers as missing, has no
+        blacklisted user and the database is not asked.
+
+        Args:
+            guild_id (int): The ID of the guild.
+
+        Returns:
+            BlacklistRecord: The cached record of the guild.
+        """
+        return await self._cache_manager.record(guild_id)
+
+    async def contains(self, guild_id: int, user_id: int) -> bool:
+        """Checks whether the user is blacklisted in the guild, see :BlacklistDatabase:record:.
+
+        Args:
+            guild_id (int): The ID of the guild.
+            user_id (int): The ID of the user.
+
+        Returns:
+            bool: Whether or not the user is blacklisted.
+        """
+        return user_id in await self.record(guild_id)
+
+    async def add(self, guild_id: int, user_id: int, fields: dict) -> dict:
+        """Adds a user to the blacklist of the guild, see :BlacklistManager:add:.
+        Only the document of the user is written to the database.
+
+        Args:
+            guild_id (int): The ID of the guild.
+            user_id (int): The ID of the user.
+            fields (dict): The blacklist entry of the user, e.g. its reason.
+
+        Returns:
+            dict: The new entry of the guild.
+        """
+        stored = await self._cache_manager.stored_entry(guild_id)
+        if stored is None:
+            # pulls the guild from the database if it is not stored locally, to keep its other users
+            stored = await self._query({"_id": guild_id}) or {}
+        entry = {**stored, "blacklist": {
+            **(stored.get("blacklist") or {}), str(user_id): fields}}
+        await self._cache_manager.insert_one(guild_id, entry)
+        await self._writes.put((guild_id, user_id), fields)
+        await self._publish(guild_id, entry)
+        return entry
@@ -0,0 +1,50 @@
+from typing import Iterable, Optional
+
+
+class ShardPartition:
+    """The shards whose guilds this process keeps in its caches.
+
+    A guild belongs to shard `(guild_id >> 22) % shard_count`. Without shard information every guild is owned.
+    """
+
+    def __init__(self, shard_ids: Optional[Iterable[int]] = None, shard_count: Optional[int] = None) -> None:
+        self.shard_ids: Optional[frozenset] = None
+        self.shard_count: Optional[int] = None
+        self.update(shard_ids, shard_count)
+
+    def update(self, shard_ids: Optional[Iterable[int]], shard_count: Optional[int]) -> bool:
+        """Replaces the owned shards.
+
+        Args:
+            shard_ids (Optional[Iterable[int]]): The IDs of the shards run by this process.
+            shard_count (Optional[int]): The total number of shards of the bot.
+
+        Returns:
+            bool: Whether or not the owned shards changed.
+        """
+        shard_ids = frozenset(shard_ids) if shard_ids is not None else None
+        if shard_count is None or shard_ids is None:
+            shard_ids, shard_count = None, None
+
+        changed = (shard_ids, shard_count) != (
+            self.shard_ids, self.shard_count)
+        self.shard_ids, self.shard_count = shard_ids, shard_count
+        return changed
+
+    def owns(self, guild_id) -> bool:
+        """Checks whether the guild is handled by one of the owned shards.
+
+        Args:
+            guild_id (Union[int, str]): The ID of the guild.
+
+        Returns:
+            bool: Whether or not this process handles the guild.
+        """
+        if self.shard_count is None:
+            return True
+        return (int(guild_id) >> 22) % self.shard_count in self.shard_ids
+
+    def __repr__(self) -> str:
+        if self.shard_count is None:
+            return "ShardPartition(all)"
+        return f"ShardPartition({sorted(self.shard_ids)}/{self.shard_count})"
@@ -0,0 +1,47 @@
+import asyncio
+from typing import Awaitable, Callable, Hashable
+from .metrics import metrics
+
+
+class SingleFlight:
+    """Deduplicates concurrent fetches of the same key.
+
+    The first caller for a key starts the fetch, callers arriving while it is in flight wait for the same
+    result, or the same exception. The fetch is shielded, so a cancelled waiter does not cancel it for the others.
+    """
+
+    def __init__(self, layer: str, collection: str) -> None:
+        self._labels = (("layer", layer), ("collection", collection))
+        self._calls: dict = {}
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._calls
+
+    def __len__(self) -> int:
+        return len(self._calls)
+
+    async def do(self, key: Hashable, fetch: Callable[[], Awaitable]):
+        """Runs the fetch for the key, or joins the one already in flight.
+
+        Args:
+            key (Hashable): The key being fetched.
+            fetch (Callable[[], Awaitable]): Starts the fetch, only called if none is in flight.
+
+        Returns:
+            Any: The result of the fetch.
+        """
+        task = self._calls.get(key)
+        if task is None:
+            task = self._calls[key] = asyncio.ensure_future(fetch())
+            # added before any waiter, so the key is released before they resume
+            task.add_done_callback(lambda done: self._release(key, done))
+        else:
+            metrics.inc("king_storage_coalesced_total", self._labels)
+        return await asyncio.shield(task)
+
+    def _release(self, key: Hashable, task: asyncio.Future) -> None:
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        # every waiter may have been cancelled, the exception still counts as retrieved
+        if not task.cancelled():
+            task.exception()
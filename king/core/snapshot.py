@@ -0,0 +1,132 @@
+import json
+import mmap
+from pathlib import Path
+import struct
+from typing import Optional
+import yaml
+from .persistence import atomic_write
+
+
+class YamlSnapshot:
+    """Snapshot format storing every entry in a single YAML document.
+
+    Reading a single entry parses the whole file.
+    """
+
+    suffix = ".yaml"
+
+    def load(self, path: Path) -> dict:
+        """Reads every entry of the snapshot.
+
+        Args:
+            path (Path): The snapshot file.
+
+        Returns:
+            dict: Every entry keyed by guild id.
+        """
+        with open(path) as p:
+            return yaml.load(p, Loader=yaml.FullLoader) or {}
+
+    def get(self, path: Path, key: str) -> Optional[dict]:
+        """Reads a single entry of the snapshot.
+
+        Args:
+            path (Path): The snapshot file.
+            key (str): The guild id of the entry.
+
+        Returns:
+            Optional[dict]: The entry or None if it does not exist.
+        """
+        return self.load(path).get(key, None)
+
+    def dump(self, path: Path, storage: dict) -> None:
+        """Atomically replaces the snapshot with the given entries.
+
+        Args:
+            path (Path): The snapshot file.
+            storage (dict): Every entry keyed by guild id.
+        """
+        atomic_write(path, yaml.safe_dump(storage))
+
+
+class BinarySnapshot:
+    """Length-prefixed snapshot format indexed by guild id.
+
+    The file starts with a header (magic, version, entry count) followed by an index of
+    `(guild id, offset, length)` records sorted by guild id, then the JSON encoded entries.
+    A single entry is read through mmap with a binary search over the index, without parsing the rest of the file.
+    """
+
+    suffix = ".bin"
+    magic = b"KSNP"
+    version = 1
+    header = struct.Struct("<4sBxxxI")
+    record = struct.Struct("<qQI")
+
+    def _entries(self, data) -> int:
+        if len(data) < self.header.size:
+            return 0
+        magic, version, count = self.header.unpack_from(data, 0)
+        if magic != self.magic or version != self.version:
+            raise ValueError(
+                f"Not a version {self.version} binary snapshot")
+        return count
+
+    def _read(self, data, index: int) -> tuple:
+        return self.record.unpack_from(data, self.header.size + index * self.record.size)
+
+    def load(self, path: Path) -> dict:
+        with open(path, "rb") as p:
+            data = p.read()
+
+        storage = {}
+        for i in range(self._entries(data)):
+            guild_id, offset, length = self._read(data, i)
+            storage[str(guild_id)] = json.loads(data[offset:offset + length])
+        return storage
+
+    def get(self, path: Path, key: str) -> Optional[dict]:
+        guild_id = int(key)
+        with open(path, "rb") as p:
+            if Path(path).stat().st_size == 0:
+                return None
+
+            with mmap.mmap(p.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                i = self._search(data, self._entries(data), guild_id)
+                if i is None:
+                    return None
+                _, offset, length = self._read(data, i)
+                return json.loads(data[offset:offset + length])
+
+    def _search(self, data, count: int, guild_id: int) -> Optional[int]:
+        # binary search over the sorted index, unpacking only the records it visits
+        lo, hi = 0, count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._read(data, mid)[0] < guild_id:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < count and self._read(data, lo)[0] == guild_id:
+            return lo
+        return None
+
+    def dump(self, path: Path, storage: dict) -> None:
+        items = sorted((int(key), json.dumps(value, separators=(",", ":")).encode())
+                       for key, value in storage.items())
+        offset = self.header.size + len(items) * self.record.size
+
+        index, bodies = [], []
+        for guild_id, body in items:
+            index.append(self.record.pack(guild_id, offset, len(body)))
+            bodies.append(body)
+            offset += len(body)
+
+        atomic_write(path, b"".join(
+            [self.header.pack(self.magic, self.version, len(items)), *index, *bodies]))
+
+
+formats = {
+    "yaml": YamlSnapshot,
+    "binary": BinarySnapshot,
+}
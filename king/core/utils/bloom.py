@@ -0,0 +1,135 @@
+import math
+
+
+class BloomFilter:
+    """Fixed size probabilistic set of `(guild_id, user_id)` pairs.
+
+    It never answers no for a pair that was added, and answers yes for a pair that was not added
+    with a probability of about `error_rate` while it holds at most `capacity` pairs.
+    """
+
+    def __init__(self, capacity: int, error_rate: float) -> None:
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.size = max(8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.count = 0
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, guild_id: int, user_id: int):
+        # double hashing, two independent tuple hashes give every position
+        h1 = hash((guild_id, user_id))
+        h2 = hash((user_id, guild_id)) | 1
+        for i in range(self.hashes):
+            yield (h1 + i * h2) % self.size
+
+    def add(self, guild_id: int, user_id: int) -> None:
+        for position in self._positions(guild_id, user_id):
+            self._bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, pair: tuple) -> bool:
+        return all(
+            self._bits[position >> 3] & (1 << (position & 7))
+            for position in self._positions(*pair)
+        )
+
+
+class BlacklistFilter:
+    """Membership pre-check for blacklisted `(guild_id, user_id)` pairs.
+
+    A negative answer is exact, so the storage only has to be asked when the filter says maybe.
+    Once a stage holds its capacity a larger one is added, keeping the false positive rate bounded
+    as the blacklist grows without having to re-read every entry.
+    """
+
+    def __init__(self, capacity: int = 1024, error_rate: float = 0.01) -> None:
+        self.error_rate = error_rate
+        self._stages: list = [BloomFilter(capacity, error_rate / 2)]
+        self.checks = 0
+        self.rejected = 0
+        self.false_positives = 0
+
+    @classmethod
+    def from_storage(cls, storage: dict, error_rate: float = 0.01) -> "BlacklistFilter":
+        """Builds a filter holding every pair of the given blacklist storage.
+
+        Args:
+            storage (dict): The blacklist entries keyed by guild id, as found in the YAML file.
+            error_rate (float, optional): The target false positive rate. Defaults to 0.01.
+
+        Returns:
+            BlacklistFilter: The new filter.
+        """
+        total = sum(len((entry or {}).get("blacklist") or {})
+                    for entry in storage.values())
+        filter_ = cls(max(1024, total * 2), error_rate)
+        for guild_id, entry in storage.items():
+            filter_.add_entry(guild_id, entry)
+        return filter_
+
+    def add(self, guild_id: int, user_id: int) -> None:
+        """Adds a blacklisted pair to the filter.
+
+        Args:
+            guild_id (int): The ID of the guild.
+            user_id (int): The ID of the blacklisted user.
+        """
+        pair = (int(guild_id), int(user_id))
+        # entries are added again whenever their guild is rewritten, only new pairs count towards the capacity
+        if any(pair in stage for stage in self._stages):
+            return
+        stage = self._stages[-1]
+        if stage.count >= stage.capacity:
+            # each new stage is twice as large with half the error rate, so the total stays below error_rate
+            stage = BloomFilter(stage.capacity * 2, stage.error_rate / 2)
+            self._stages.append(stage)
+        stage.add(*pair)
+
+    def add_entry(self, guild_id, entry: dict) -> None:
+        """Adds every user of a guild's blacklist entry to the filter.
+
+        Args:
+            guild_id (Union[int, str]): The ID of the guild.
+            entry (dict): The blacklist entry of the guild.
+        """
+        for user_id in (entry or {}).get("blacklist") or {}:
+            self.add(guild_id, user_id)
+
+    def might_contain(self, guild_id: int, user_id: int) -> bool:
+        """Checks whether the pair may be blacklisted.
+
+        Args:
+            guild_id (int): The ID of the guild.
+            user_id (int): The ID of the user.
+
+        Returns:
+            bool: False if the user is certainly not blacklisted, True if the storage has to be asked.
+        """
+        self.checks += 1
+        pair = (guild_id, user_id)
+        for stage in self._stages:
+            if pair in stage:
+                return True
+
+        self.rejected += 1
+        return False
+
+    def report_false_positive(self) -> None:
+        """Records that the storage did not confirm a pair the filter let through."""
+        self.false_positives += 1
+
+    @property
+    def stats(self) -> dict:
+        """Counters for tuning the filter."""
+        passed = self.checks - self.rejected
+        return {
+            "checks": self.checks,
+            "rejected": self.rejected,
+            "passed": passed,
+            "false_positives": self.false_positives,
+            "false_positive_rate": self.false_positives / passed if passed else 0.0,
+            "entries": sum(stage.count for stage in self._stages),
+            "stages": len(self._stages),
+            "bytes": sum(len(stage._bits) for stage in self._stages),
+        }
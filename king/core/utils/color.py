@@ -1,4 +1,11 @@
-from typing import Union
+import atexit
+import logging
+from logging.handlers import QueueHandler, QueueListener
+import os
+import queue
+import re
+import sys
+from typing import Optional, Union
 
 
 class NoMessageTypeError(Exception):
@@ -33,15 +40,110 @@ class Color:
     def reset(x): return Color.RESET + str(x)
 
 
+logging.addLevelName(15, "DATA")
+logging.addLevelName(25, "SUCCESS")
+
+# message type: (logging level, color, tag)
+LEVELS = {
+    "DEBUG": (logging.DEBUG, Color.MAGENTA, "[DEBUG!] : "),
+    "DATA": (15, Color.BLUE, "[DATA!] : "),
+    "INFO": (logging.INFO, Color.YELLOW, "[INFO!] : "),
+    "SUCCESS": (25, Color.GREEN, "[SUCCESS!] : "),
+    "BANNER": (25, Color.CYAN, ""),
+    "ERROR": (logging.ERROR, Color.RED, "[ERROR!] : "),
+}
+# the levels `log_level` may be set to, BANNER is only a way of printing
+LOG_LEVELS = tuple(name for name in LEVELS if name != "BANNER")
+
+_ANSI = re.compile(r"\x1b\[[0-9;]*m")
+
+log = logging.getLogger("king")
+_color: bool = sys.stdout.isatty() and "NO_COLOR" not in os.environ
+_listener: Optional[QueueListener] = None
+
+
+class _DeferredQueueHandler(QueueHandler):
+    """Queues records as they are, so they are formatted by the listener thread instead of the event loop."""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+class PrinterFormatter(logging.Formatter):
+    """Formats records the way `printer` always did, optionally without colors, truncating long messages."""
+
+    def __init__(self, color: bool, max_length: int) -> None:
+        super().__init__()
+        self.color = color
+        self.max_length = max_length
+
+    def format(self, record: logging.LogRecord) -> str:
+        msg = record.getMessage()
+        if self.max_length and len(msg) > self.max_length:
+            msg = f"{msg[:self.max_length]}... ({len(msg) - self.max_length} more characters)"
+        if record.exc_info:
+            msg += "\n" + self.formatException(record.exc_info)
+
+        msg_type = getattr(record, "msg_type", record.levelname)
+        _, color, tag = LEVELS.get(msg_type, LEVELS["INFO"])
+        if not self.color:
+            return _ANSI.sub("", tag + msg)
+        return color + tag + msg + Color.RESET + " "
+
+
+def configure_logging(level: Union[int, str] = "DATA", color: Optional[bool] = None, max_length: int = 2000) -> None:
+    """(Re)starts the background thread writing the `king` logs to stdout.
+
+    `printer` only puts records on a queue, the formatting and the writes happen on the listener thread,
+    so logging never blocks the event loop.
+
+    Args:
+        level (Union[int, str], optional): The lowest level that is logged, e.g. `INFO` or `DATA`. Defaults to "DATA".
+        color (Optional[bool], optional): Whether to use ANSI colors, by default only on a terminal without `NO_COLOR`. Defaults to None.
+        max_length (int, optional): The number of characters messages are truncated to, 0 to never truncate. Defaults to 2000.
+
+    Raises:
+        ValueError: Raised when the level is unknown, in which case the running listener is kept.
+    """
+    global _color, _listener
+    # resolved before anything is torn down, a bad level must not leave the logs without a listener
+    if isinstance(level, str):
+        if level.upper() not in LOG_LEVELS:
+            raise ValueError(colorify("ERROR", f"Unknown log level {level}"))
+        level = LEVELS[level.upper()][0]
+    if color is not None:
+        _color = color
+
+    if _listener is not None:
+        _listener.stop()
+
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(PrinterFormatter(_color, max_length))
+    records: queue.SimpleQueue = queue.SimpleQueue()
+    _listener = QueueListener(records, handler)
+
+    log.handlers = [_DeferredQueueHandler(records)]
+    log.setLevel(level)
+    log.propagate = False
+    _listener.start()
+
+
+atexit.register(lambda: _listener and _listener.stop())
+configure_logging()
+
+
 def printer(msg_type: str, msg: Union[int, str, float]) -> None:
     """Printing method for specific types of messages.
 
+    The message is only queued, it is written by a background thread, see :configure_logging:.
+
     Args:
         msg_type (str): Type of message to send. Options are:
         - INFO: yellow 
         - ERROR: red
         - BANNER: cyan
         - DEBUG: magenta
+        - DATA: blue
         - SUCCESS: green
 
         msg (str): The message to send.
@@ -49,25 +151,20 @@ def printer(msg_type: str, msg: Union[int, str, float]) -> None:
     Raises:
         NoMessageTypeError: Raised when no message type was provided.
     """
+    if msg_type not in LEVELS:
+        raise NoMessageTypeError("No message type was provided.")
 
-    if msg_type == "INFO":
-        return print(Color.yellow("[INFO!] : " + str(msg)) + Color.reset(" "))
-    elif msg_type == "ERROR":
-        return print(Color.red("[ERROR!] : " + str(msg)) + Color.reset(" "))
-    elif msg_type == "BANNER":
-        return print(Color.cyan(str(msg)) + Color.reset(" "))
-    elif msg_type == "DEBUG":
-        return print(Color.magenta("[DEBUG!] : " + str(msg)) + Color.reset(" "))
-    elif msg_type == "DATA":
-        return print(Color.blue("[DATA!] : " + str(msg)) + Color.reset(" "))
-    elif msg_type == "SUCCESS":
-        return print(Color.green("[SUCCESS!] : " + str(msg)) + Color.reset(" "))
-
-    raise NoMessageTypeError("No message type was provided.")
+    level = LEVELS[msg_type][0]
+    if not log.isEnabledFor(level):
+        return
+    if not isinstance(msg, str):
+        # turned into text right away, the payload may change before the listener formats it, which truncates it
+        msg = str(msg)
+    log.log(level, msg, extra={"msg_type": msg_type})
 
 
 def colorify(msg_type: str, msg: Union[int, str, float]) -> str:
-    """Returns colored text for use anywhere needed,
+    """Returns colored text for use anywhere needed, plain text when colors are disabled.
 
     Args:
         msg_type (str): Type of message to send. Options are:
@@ -75,6 +172,7 @@ def colorify(msg_type: str, msg: Union[int, str, float]) -> str:
         - ERROR: red
         - BANNER: cyan
         - DEBUG: magenta
+        - DATA: blue
         - SUCCESS: green
 
         msg (Union[int, str, float]): The message to send.
@@ -85,17 +183,10 @@ def colorify(msg_type: str, msg: Union[int, str, float]) -> str:
     Returns:
         str: Colored string.
     """
-    if msg_type == "INFO":
-        return(Color.yellow("[INFO!] : " + str(msg)) + Color.reset(" "))
-    elif msg_type == "ERROR":
-        return(Color.red("[ERROR!] : " + str(msg)) + Color.reset(" "))
-    elif msg_type == "BANNER":
-        return(Color.cyan(str(msg)) + Color.reset(" "))
-    elif msg_type == "DEBUG":
-        return(Color.magenta("[DEBUG!] : " + str(msg)) + Color.reset(" "))
-    elif msg_type == "DATA":
-        return(Color.blue("[DATA!] : " + str(msg)) + Color.reset(" "))
-    elif msg_type == "SUCCESS":
-        return(Color.green("[SUCCESS!] : " + str(msg)) + Color.reset(" "))
-
-    raise NoMessageTypeError("No message type was provided.")
+    if msg_type not in LEVELS:
+        raise NoMessageTypeError("No message type was provided.")
+
+    _, color, tag = LEVELS[msg_type]
+    if not _color:
+        return _ANSI.sub("", tag + str(msg))
+    return color + tag + str(msg) + Color.RESET + " "
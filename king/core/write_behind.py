@@ -0,0 +1,114 @@
+import asyncio
+from typing import Optional
+from .utils.color import printer
+
+
+class WriteBehindQueue:
+    """Collects pending upserts for a single collection and writes them with one `bulk_write`.
+
+    Upserts for the same `_id` are merged while they wait, so a burst of writes costs one round trip
+    per batch instead of one per write. A batch is sent once `batch_size` documents are pending or
+    `interval` seconds after the first pending write, whichever comes first. Every upsert stamps
+    `updated_at` with the server time, which the startup delta sync pulls by.
+
+    Documents are identified by `_id` unless other `key_fields` are given, their keys are then tuples
+    of the values of those fields, e.g. `(guild_id, user_id)`.
+    """
+
+    def __init__(self, collection, batch_size: int = 100, interval: float = 1.0, key_fields: tuple = ("_id",)) -> None:
+        self._collection = collection
+        self.key_fields = key_fields
+        self.batch_size = batch_size
+        self.interval = interval
+        self._pending: dict = {}
+        self._handle: Optional[asyncio.TimerHandle] = None
+        self._lock: Optional[asyncio.Lock] = None
+
+    @property
+    def depth(self) -> int:
+        """The number of documents waiting to be written."""
+        return len(self._pending)
+
+    def __contains__(self, _id) -> bool:
+        return _id in self._pending
+
+    def keys(self) -> list:
+        """The keys of the documents waiting to be written."""
+        return list(self._pending)
+
+    async def put(self, _id, fields: dict) -> None:
+        """Queues an upsert that sets the given fields on the document with the given `_id`.
+
+        Args:
+            _id (Any): The `_id` of the document to upsert.
+            fields (dict): The fields to set on the document.
+        """
+        self._pending.setdefault(_id, {}).update(fields)
+
+        if self.depth >= self.batch_size:
+            await self.flush()
+        elif self._handle is None:
+            loop = asyncio.get_event_loop()
+            self._handle = loop.call_later(self.interval, self._flush_soon)
+
+    async def put_many(self, documents: dict) -> None:
+        """Queues an upsert for each document and sends them all right away, in one `bulk_write`.
+
+        Args:
+            documents (dict): The fields to set, keyed by the `_id` of each document.
+        """
+        for _id, fields in documents.items():
+            self._pending.setdefault(_id, {}).update(fields)
+        await self.flush()
+
+    def _filter(self, key) -> dict:
+        if len(self.key_fields) == 1:
+            return {self.key_fields[0]: key}
+        return dict(zip(self.key_fields, key))
+
+    def _flush_soon(self) -> None:
+        self._handle = None
+        asyncio.ensure_future(self.flush())
+
+    async def flush(self) -> None:
+        """Sends every pending upsert to the database in a single unordered `bulk_write`."""
+        # imported on first use like motor, local storage never needs it
+        from pymongo import UpdateOne
+        from pymongo.errors import BulkWriteError, PyMongoError
+
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+
+        async with self._lock:
+            if not self._pending:
+                return
+
+            batch, self._pending = self._pending, {}
+            requests = [
+                UpdateOne(
+                    self._filter(_id),
+                    {"$set": fields, "$currentDate": {"updated_at": True}},
+                    upsert=True,
+                )
+                for _id, fields in batch.items()
+            ]
+
+            try:
+                await self._collection.bulk_write(requests, ordered=False)
+            except BulkWriteError as e:
+                printer(
+                    "ERROR", f"{len(e.details.get('writeErrors', []))}/{len(requests)} WRITES FAILED FOR {self._collection.name}: {e.details.get('writeErrors')}")
+            except PyMongoError as e:
+                printer(
+                    "ERROR", f"FAILED TO WRITE {len(requests)} DOCUMENTS TO {self._collection.name}, RETRYING: {e}")
+                # newer writes for the same document win over the failed ones
+                for _id, fields in batch.items():
+                    self._pending[_id] = {**fields, **self._pending.get(_id, {})}
+                if self._handle is None:
+                    loop = asyncio.get_event_loop()
+                    self._handle = loop.call_later(
+                        self.interval, self._flush_soon)
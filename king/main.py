@@ -1,25 +1,48 @@
-import logging
+import argparse
 from pathlib import Path
-from discord import Intents
-from core.bot import KingBot
+from core.profiler import profiler
+from core.utils.color import printer
 
 
-# LOGS
-log = logging.getLogger('king')
-log.setLevel(logging.INFO)
+parser = argparse.ArgumentParser(description="Runs the bot.")
+parser.add_argument("--profile-startup", metavar="REPORT", nargs="?", const="startup_profile.json",
+                    help="record the duration and allocations of each startup phase, write them as JSON and exit once the extensions are loaded")
+parser.add_argument("--cprofile", metavar="PATH",
+                    help="with --profile-startup, also dump cProfile stats of the startup")
 
-# INTENTS
-intents = Intents.all()
 
-# CONFIG YAML
-config = Path("config.yaml")
+def main() -> None:
+    args = parser.parse_args()
+    if args.profile_startup:
+        profiler.enable(cprofile=args.cprofile is not None)
 
+    with profiler.phase("imports"):
+        from discord import Intents
+        from core.bot import KingBot
 
-bot = KingBot(
-    command_prefix=KingBot.get_prefix,
-    intents=intents,
-    config=config
-)
+    # INTENTS
+    intents = Intents.all()
+
+    # CONFIG YAML
+    config = Path("config.yaml")
+
+    with profiler.phase("bot"):
+        bot = KingBot(
+            command_prefix=KingBot.get_prefix,
+            intents=intents,
+            config=config
+        )
+
+    if args.profile_startup:
+        @bot.listen()
+        async def on_extensions_loaded():
+            report = profiler.finish(args.cprofile)
+            profiler.write(Path(args.profile_startup), report)
+            printer("INFO", f"WROTE STARTUP PROFILE TO {args.profile_startup}")
+            await bot.close()
 
-if __name__ == '__main__':
     bot.run()
+
+
+if __name__ == '__main__':
+    main()
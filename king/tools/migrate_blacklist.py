@@ -0,0 +1,94 @@
+"""Converts a blacklist collection from one document per guild to one document per blacklisted user.
+
+Documents such as `{_id: guild_id, blacklist: {user_id: {reason: ...}}}` become one
+`{guild_id, user_id, reason, updated_at}` document per user, unique by the `(guild_id, user_id)`
+index created once they are all converted. A guild document is only deleted once all of its users have been written, so the migration
+can be interrupted and run again. The local storage keeps its format and needs no migration.
+
+Run from the `king` directory, with the database of `config.yaml`:
+
+    python -m tools.migrate_blacklist --dry-run
+    python -m tools.migrate_blacklist
+"""
+import argparse
+import asyncio
+from pathlib import Path
+import yaml
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import DeleteOne, UpdateOne
+from core.settings_db import BlacklistDatabase
+
+
+async def migrate(collection, batch_size: int = 1000, dry_run: bool = False) -> tuple:
+    """Moves every user of the guild documents of the collection into their own document.
+
+    Args:
+        collection (AsyncIOMotorCollection): The blacklist collection.
+        batch_size (int, optional): Writes per `bulk_write`. Defaults to 1000.
+        dry_run (bool, optional): Only count the documents that would be converted. Defaults to False.
+
+    Returns:
+        tuple: The number of converted guild documents and of written user documents.
+    """
+
+    guilds = users = 0
+    requests = []
+
+    async def write() -> None:
+        # ordered and sent in sequence, a guild document is only deleted once every upsert before it succeeded
+        if requests and not dry_run:
+            await collection.bulk_write(requests, ordered=True)
+        requests.clear()
+
+    cursor = collection.find(
+        {"blacklist": {"$exists": True}}, {"blacklist": 1}, batch_size=batch_size)
+    async for doc in cursor:
+        guild_id = int(doc["_id"])
+        for user_id, fields in (doc["blacklist"] or {}).items():
+            update = {"$currentDate": {"updated_at": True}}
+            if fields:
+                update["$set"] = fields
+            requests.append(UpdateOne(
+                {"guild_id": guild_id, "user_id": int(user_id)}, update, upsert=True))
+            users += 1
+            if len(requests) >= batch_size:
+                await write()
+        requests.append(DeleteOne({"_id": doc["_id"]}))
+        guilds += 1
+        if len(requests) >= batch_size:
+            await write()
+
+    await write()
+    if not dry_run:
+        # only once every guild document is gone, they would collide in the unique index
+        await BlacklistDatabase.create_index(collection)
+    return guilds, users
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--config", type=Path, default=Path("config.yaml"))
+    parser.add_argument("--mongo-uri", help="defaults to mongo_db_uri of the config")
+    parser.add_argument("--name", help="the database, defaults to name of the config")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+
+    config = {}
+    if args.config.exists():
+        with open(args.config) as stream:
+            config = yaml.safe_load(stream) or {}
+    uri = args.mongo_uri or config.get("mongo_db_uri")
+    if not uri:
+        parser.error("no database configured, pass --mongo-uri")
+
+    collection = AsyncIOMotorClient(uri)[args.name or config.get(
+        "name", "KingBot")][BlacklistDatabase.collection_name]
+    guilds, users = asyncio.get_event_loop().run_until_complete(
+        migrate(collection, args.batch_size, args.dry_run))
+    print(
+        f"{'would convert' if args.dry_run else 'converted'} {guilds} guild documents into {users} user documents")
+
+
+if __name__ == "__main__":
+    main()